@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+PPT压缩性能基准测试
+
+生成可复现的合成PPTX(照片、截图、透明PNG、GIF、重复图片、大量幻灯片XML)，
+逐个档位压缩，记录各阶段耗时与吞吐量、峰值内存和压缩率，结果保存为JSON，
+方便在不同提交之间对比。
+
+用法:
+  python3 benchmark.py                          # 默认语料，测试全部档位
+  python3 benchmark.py --photos 40 --slides 200 -p balanced -p mini
+  python3 benchmark.py -o after.json --compare before.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import zipfile
+import argparse
+import platform
+import subprocess
+import tempfile
+import multiprocessing
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from ppt_compressor_v3 import ModernPPTCompressor, Tracer, EMU_PER_INCH
+
+try:
+    import resource
+except ImportError:  # Windows没有resource模块，不统计峰值内存
+    resource = None
+
+
+RELS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+REL_TYPE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NAMESPACES = ('xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+              'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+              'xmlns:p="http://schemas.openxmlformats.org/presentationml/2006/main"')
+CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.presentationml'
+
+# 默认语料
+DEFAULT_CORPUS = {
+    'photos': 12,          # JPEG照片
+    'screenshots': 8,      # 不透明的PNG截图
+    'transparent': 8,      # 带透明度的PNG
+    'gifs': 4,             # GIF
+    'duplicates': 6,       # 额外复制的重复图片成员
+    'slides': 40,          # 幻灯片数量
+    'xml_kb': 20,          # 每张幻灯片的XML大小(KB)
+    'width': 1600,         # 图片宽度
+    'height': 1200,        # 图片高度
+}
+
+
+def make_photo(rng, width, height):
+    """类似照片的JPEG：分形图案 + 噪声 + 模糊"""
+    x0 = rng.uniform(-2.0, -0.5)
+    y0 = rng.uniform(-1.2, 0.2)
+    base = Image.effect_mandelbrot((width, height), (x0, y0, x0 + 1.5, y0 + 1.0), rng.randint(40, 120))
+    noise = Image.effect_noise((width, height), rng.randint(10, 40))
+    red = base.filter(ImageFilter.GaussianBlur(2))
+    green = Image.blend(base, noise, 0.4).filter(ImageFilter.GaussianBlur(1))
+    blue = noise.filter(ImageFilter.GaussianBlur(3))
+    img = Image.merge('RGB', (red, green, blue))
+    output = io.BytesIO()
+    img.save(output, format='JPEG', quality=95)
+    return output.getvalue(), 'jpeg'
+
+
+def make_screenshot(rng, width, height):
+    """类似界面截图的PNG：纯色块、线条和文字状的条纹，低压缩级别"""
+    img = Image.new('RGB', (width, height), (rng.randint(230, 255),) * 3)
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(10, 30)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        color = tuple(rng.randrange(256) for _ in range(3))
+        draw.rectangle([x, y, x + rng.randint(40, 400), y + rng.randint(20, 200)], fill=color)
+    for row in range(0, height, 18):
+        for col in range(rng.randint(0, 40), width - 40, rng.randint(40, 120)):
+            draw.line([col, row, col + rng.randint(10, 35), row], fill=(40, 40, 40), width=2)
+    output = io.BytesIO()
+    img.save(output, format='PNG', compress_level=1)
+    return output.getvalue(), 'png'
+
+
+def make_transparent(rng, width, height):
+    """带透明度的PNG：透明背景上的半透明图形"""
+    img = Image.new('RGBA', (width, height), (0, 0, 0, 0))
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(5, 20)):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randint(20, 300)
+        color = tuple(rng.randrange(256) for _ in range(3)) + (rng.randint(80, 255),)
+        draw.ellipse([x - radius, y - radius, x + radius, y + radius], fill=color)
+    output = io.BytesIO()
+    img.save(output, format='PNG', compress_level=1)
+    return output.getvalue(), 'png'
+
+
+def make_gif(rng, width, height):
+    """调色板GIF：条纹图案"""
+    img = Image.new('P', (width // 2, height // 2))
+    draw = ImageDraw.Draw(img)
+    step = rng.randint(4, 16)
+    for x in range(0, img.width, step):
+        draw.line([x, 0, x, img.height], fill=rng.randrange(256), width=step // 2)
+    output = io.BytesIO()
+    img.save(output, format='GIF')
+    return output.getvalue(), 'gif'
+
+
+def slide_xml(pictures, xml_bytes, rng):
+    """生成一张幻灯片：图片形状 + 填充到指定大小的文本形状"""
+    shapes = []
+    for index, rid in enumerate(pictures):
+        shapes.append(
+            f'<p:pic><p:nvPicPr><p:cNvPr id="{index + 2}" name="Picture {index + 1}"/><p:cNvPicPr/><p:nvPr/></p:nvPicPr>'
+            f'<p:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/></a:stretch></p:blipFill>'
+            f'<p:spPr><a:xfrm><a:off x="{index * 457200}" y="0"/>'
+            f'<a:ext cx="{4 * EMU_PER_INCH}" cy="{3 * EMU_PER_INCH}"/></a:xfrm>'
+            f'<a:prstGeom prst="rect"><a:avLst/></a:prstGeom></p:spPr></p:pic>')
+    words = ['演示', '文稿', 'quarterly', 'revenue', '增长', 'roadmap', '客户', 'pipeline']
+    size = sum(len(shape) for shape in shapes)
+    shape_id = len(pictures) + 2
+    while size < xml_bytes:
+        text = ' '.join(rng.choice(words) for _ in range(30))
+        shape = (f'<p:sp><p:nvSpPr><p:cNvPr id="{shape_id}" name="TextBox {shape_id}"/><p:cNvSpPr txBox="1"/><p:nvPr/></p:nvSpPr>'
+                 f'<p:spPr><a:xfrm><a:off x="0" y="{shape_id * 10000}"/><a:ext cx="8000000" cy="400000"/></a:xfrm></p:spPr>'
+                 f'<p:txBody><a:bodyPr/><a:lstStyle/><a:p><a:r><a:rPr lang="zh-CN" sz="1800"/><a:t>{text}</a:t></a:r></a:p></p:txBody></p:sp>')
+        shapes.append(shape)
+        size += len(shape.encode('utf-8'))
+        shape_id += 1
+    return (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<p:sld {NAMESPACES}>'
+            f'<p:cSld><p:spTree><p:nvGrpSpPr><p:cNvPr id="1" name=""/><p:cNvGrpSpPr/><p:nvPr/></p:nvGrpSpPr><p:grpSpPr/>'
+            + ''.join(shapes) + '</p:spTree></p:cSld></p:sld>')
+
+
+def rels_xml(relationships):
+    """relationships: [(Id, 类型, Target)]"""
+    items = ''.join(f'<Relationship Id="{rid}" Type="{REL_TYPE}/{rel_type}" Target="{target}"/>'
+                    for rid, rel_type, target in relationships)
+    return f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<Relationships xmlns="{RELS_NS}">{items}</Relationships>'
+
+
+def generate_deck(path, corpus, seed=0):
+    """
+    生成合成PPTX，相同的参数和种子总是生成相同的文件
+
+    Returns:
+        {'images': 图片成员数, 'image_bytes': 图片总大小, 'size': 文件大小}
+    """
+    rng = random.Random(seed)
+    width, height = corpus['width'], corpus['height']
+    media = []
+    for kind, make, count in (('photo', make_photo, corpus['photos']),
+                              ('screenshot', make_screenshot, corpus['screenshots']),
+                              ('transparent', make_transparent, corpus['transparent']),
+                              ('gif', make_gif, corpus['gifs'])):
+        for _ in range(count):
+            data, ext = make(rng, width, height)
+            media.append((f'image{len(media) + 1}.{ext}', data))
+    # 重复图片：内容相同、文件名不同的成员，和PowerPoint多次插入同一张图片时一样
+    originals = list(media)
+    for _ in range(corpus['duplicates'] if originals else 0):
+        name, data = rng.choice(originals)
+        media.append((f'image{len(media) + 1}{Path(name).suffix}', data))
+
+    slides = max(1, corpus['slides'])
+    slide_media = [[] for _ in range(slides)]
+    for index, (name, _) in enumerate(media):
+        slide_media[index % slides].append(name)
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_out:
+        def write(name, data):
+            # 固定时间戳，保证相同参数生成的文件逐字节一致
+            zip_out.writestr(zipfile.ZipInfo(name, date_time=(1980, 1, 1, 0, 0, 0)), data,
+                             compress_type=zipfile.ZIP_DEFLATED)
+
+        overrides = [('/ppt/presentation.xml', f'{CONTENT_TYPE}.presentation.main+xml'),
+                     ('/ppt/slideMasters/slideMaster1.xml', f'{CONTENT_TYPE}.slideMaster+xml'),
+                     ('/ppt/slideLayouts/slideLayout1.xml', f'{CONTENT_TYPE}.slideLayout+xml'),
+                     ('/ppt/theme/theme1.xml', 'application/vnd.openxmlformats-officedocument.theme+xml')]
+        overrides += [(f'/ppt/slides/slide{i + 1}.xml', f'{CONTENT_TYPE}.slide+xml') for i in range(slides)]
+        defaults = [('rels', 'application/vnd.openxmlformats-package.relationships+xml'),
+                    ('xml', 'application/xml'), ('png', 'image/png'), ('jpeg', 'image/jpeg'), ('gif', 'image/gif')]
+        write('[Content_Types].xml',
+              '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+              + ''.join(f'<Default Extension="{ext}" ContentType="{ct}"/>' for ext, ct in defaults)
+              + ''.join(f'<Override PartName="{name}" ContentType="{ct}"/>' for name, ct in overrides)
+              + '</Types>')
+        write('_rels/.rels', rels_xml([('rId1', 'officeDocument', 'ppt/presentation.xml')]))
+
+        slide_ids = ''.join(f'<p:sldId id="{256 + i}" r:id="rId{i + 10}"/>' for i in range(slides))
+        write('ppt/presentation.xml',
+              f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<p:presentation {NAMESPACES}>'
+              '<p:sldMasterIdLst><p:sldMasterId id="2147483648" r:id="rId1"/></p:sldMasterIdLst>'
+              f'<p:sldIdLst>{slide_ids}</p:sldIdLst>'
+              '<p:sldSz cx="12192000" cy="6858000"/><p:notesSz cx="6858000" cy="9144000"/></p:presentation>')
+        write('ppt/_rels/presentation.xml.rels', rels_xml(
+            [('rId1', 'slideMaster', 'slideMasters/slideMaster1.xml'), ('rId2', 'theme', 'theme/theme1.xml')]
+            + [(f'rId{i + 10}', 'slide', f'slides/slide{i + 1}.xml') for i in range(slides)]))
+        write('ppt/slideMasters/slideMaster1.xml',
+              f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<p:sldMaster {NAMESPACES}>'
+              '<p:cSld><p:spTree/></p:cSld>'
+              '<p:sldLayoutIdLst><p:sldLayoutId id="2147483649" r:id="rId1"/></p:sldLayoutIdLst></p:sldMaster>')
+        write('ppt/slideMasters/_rels/slideMaster1.xml.rels', rels_xml(
+            [('rId1', 'slideLayout', '../slideLayouts/slideLayout1.xml'), ('rId2', 'theme', '../theme/theme1.xml')]))
+        write('ppt/slideLayouts/slideLayout1.xml',
+              f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<p:sldLayout {NAMESPACES}>'
+              '<p:cSld><p:spTree/></p:cSld></p:sldLayout>')
+        write('ppt/slideLayouts/_rels/slideLayout1.xml.rels', rels_xml(
+            [('rId1', 'slideMaster', '../slideMasters/slideMaster1.xml')]))
+        write('ppt/theme/theme1.xml',
+              '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+              '<a:theme xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" name="Office"/>')
+
+        for index in range(slides):
+            rids = [f'rId{n + 2}' for n in range(len(slide_media[index]))]
+            write(f'ppt/slides/slide{index + 1}.xml',
+                  slide_xml(rids, corpus['xml_kb'] * 1024, rng))
+            write(f'ppt/slides/_rels/slide{index + 1}.xml.rels', rels_xml(
+                [('rId1', 'slideLayout', '../slideLayouts/slideLayout1.xml')]
+                + [(rid, 'image', f'../media/{name}') for rid, name in zip(rids, slide_media[index])]))
+        for name, data in media:
+            write(f'ppt/media/{name}', data)
+
+    return {
+        'images': len(media),
+        'image_bytes': sum(len(data) for _, data in media),
+        'size': Path(path).stat().st_size,
+    }
+
+
+def peak_rss_mb():
+    """当前进程和已结束子进程的峰值内存(MB)，不支持时返回None"""
+    if resource is None:
+        return None
+    # Linux上ru_maxrss单位是KB，macOS上是字节
+    unit = 1 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit
+    return round(own / 1024 / 1024, 1), round(children / 1024 / 1024, 1)
+
+
+def run_preset(deck_path, preset, options, work_dir, verbose=False):
+    """
+    在当前进程中压缩一次并测量
+
+    各阶段和各编码器的耗时取自压缩引擎的Tracer。输出写入临时目录work_dir，
+    测量后删除，不会覆盖输入文件旁边的同名文件。
+    """
+    output_path = Path(work_dir) / f'{Path(deck_path).stem}_{preset}.pptx'
+    tracer = Tracer()
+    start = time.perf_counter()
+    compressor = ModernPPTCompressor(preset=preset, sinks=None if verbose else [], **options)
+    result = compressor.compress_ppt(deck_path, output_path, tracer=tracer)
+    end = time.perf_counter()
+
+    summary = tracer.summary()
+    stages = {name: round(item['wall'], 4) for name, item in summary.get('stage', {}).items()}
+    encoders = {name: {'count': item['count'], 'wall': round(item['wall'], 4), 'cpu': round(item['cpu'], 4)}
+                for name, item in summary.get('encoder', {}).items()}
+
+    input_size, output_size = result.input_size, result.output_size
+    output_path.unlink()
+    with zipfile.ZipFile(deck_path) as zip_in:
+        image_bytes = sum(info.file_size for info in zip_in.infolist() if compressor.is_image_file(info.filename))
+
+    throughput = {}
+    if stages.get('compress_images'):
+        throughput['images_mb_s'] = round(image_bytes / 1024 / 1024 / stages['compress_images'], 2)
+    if stages.get('repack'):
+        throughput['repack_mb_s'] = round(output_size / 1024 / 1024 / stages['repack'], 2)
+    rss = peak_rss_mb()
+    return {
+        'preset': preset,
+        'input_size': input_size,
+        'output_size': output_size,
+        'ratio': round(output_size / input_size, 4),
+        'seconds': round(end - start, 4),
+        'stages': stages,
+        'encoders': encoders,
+        'throughput': throughput,
+        'peak_rss_mb': rss[0] if rss else None,
+        'peak_rss_children_mb': rss[1] if rss else None,
+    }
+
+
+def _run_preset_child(result_queue, deck_path, preset, options, work_dir, verbose):
+    """子进程入口：每个档位单独一个进程，峰值内存互不影响"""
+    try:
+        result_queue.put(run_preset(deck_path, preset, options, work_dir, verbose))
+    except Exception as e:
+        result_queue.put({'preset': preset, 'error': str(e)})
+
+
+def run_isolated(deck_path, preset, options, work_dir, verbose=False):
+    """在新进程中运行run_preset并返回结果"""
+    context = multiprocessing.get_context('spawn')
+    result_queue = context.Queue()
+    process = context.Process(target=_run_preset_child,
+                              args=(result_queue, deck_path, preset, options, work_dir, verbose))
+    process.start()
+    result = result_queue.get()
+    process.join()
+    return result
+
+
+def git_commit():
+    """当前提交的哈希，不在git仓库中时返回None"""
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=Path(__file__).resolve().parent, timeout=5)
+    except Exception:
+        return None
+    return result.stdout.strip() or None
+
+
+def print_comparison(results, baseline):
+    """与之前保存的结果按档位对比耗时和压缩率"""
+    previous = {item['preset']: item for item in baseline.get('results', [])}
+    print(f"\n📊 与 {baseline.get('commit') or '基准'} 对比:")
+    for item in results:
+        before = previous.get(item['preset'])
+        if not before or 'error' in item or 'error' in before:
+            continue
+        speed = (before['seconds'] - item['seconds']) / before['seconds'] * 100 if before['seconds'] else 0
+        print(f"  {item['preset']:<10} 耗时 {before['seconds']:.2f}s → {item['seconds']:.2f}s ({speed:+.1f}% 更快)  "
+              f"压缩率 {before['ratio']:.3f} → {item['ratio']:.3f}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description='PPT压缩性能基准测试')
+    for key, value in DEFAULT_CORPUS.items():
+        parser.add_argument(f'--{key.replace("_", "-")}', type=int, default=value,
+                            help=f'语料参数（默认: {value}）')
+    parser.add_argument('--seed', type=int, default=0, help='生成语料的随机种子（默认: 0）')
+    parser.add_argument('-p', '--preset', action='append', choices=list(ModernPPTCompressor.PRESETS),
+                        help='要测试的档位，可重复指定（默认: 全部档位）')
+    parser.add_argument('-j', '--workers', type=int, default=None, help='压缩进程数（默认: CPU核心数）')
+    parser.add_argument('-o', '--output', default='benchmark_results.json', help='结果JSON文件')
+    parser.add_argument('--compare', help='与之前保存的结果JSON对比')
+    parser.add_argument('--deck', help='使用已有的PPTX文件代替合成语料')
+    parser.add_argument('--keep-deck', action='store_true', help='保留生成的合成PPTX')
+    parser.add_argument('-v', '--verbose', action='store_true', help='显示压缩过程的输出')
+    args = parser.parse_args()
+
+    corpus = {key: getattr(args, key) for key in DEFAULT_CORPUS}
+    presets = args.preset or list(ModernPPTCompressor.PRESETS)
+    options = {'workers': args.workers}
+    work_dir = Path(tempfile.mkdtemp(prefix='ppt_benchmark_'))
+
+    if args.deck:
+        deck_path = str(Path(args.deck).resolve())
+        deck_info = {'size': Path(deck_path).stat().st_size}
+        print(f"📄 使用已有文件: {deck_path}")
+    else:
+        deck_path = str(work_dir / f'synthetic_{args.seed}.pptx')
+        print("🧪 生成合成语料...")
+        start = time.perf_counter()
+        deck_info = generate_deck(deck_path, corpus, args.seed)
+        print(f"   {deck_info['images']} 个图片，{deck_info['size'] / 1024 / 1024:.1f} MB，"
+              f"耗时 {time.perf_counter() - start:.1f}s")
+
+    results = []
+    for preset in presets:
+        print(f"⏱️  {preset}...", end=' ', flush=True)
+        result = run_isolated(deck_path, preset, options, str(work_dir), args.verbose)
+        results.append(result)
+        if 'error' in result:
+            print(f"❌ {result['error']}")
+            continue
+        stages = ', '.join(f'{stage} {seconds:.2f}s' for stage, seconds in result['stages'].items()
+                           if seconds >= 0.01)
+        print(f"{result['seconds']:.2f}s  压缩率 {result['ratio']:.3f}  峰值内存 {result['peak_rss_mb']} MB  ({stages})")
+
+    report = {
+        'version': 1,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'corpus': None if args.deck else dict(corpus, seed=args.seed),
+        'deck': deck_info,
+        'options': options,
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 结果已保存: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(results, json.load(f))
+
+    if args.keep_deck and not args.deck:
+        print(f"📄 合成语料: {deck_path}")
+    else:
+        if not args.deck:
+            Path(deck_path).unlink()
+        try:
+            work_dir.rmdir()
+        except OSError:
+            pass
+
+
+if __name__ == '__main__':
+    main()
@@ -14,7 +14,7 @@ from pathlib import Path
 import queue
 
 # 导入核心压缩功能
-from ppt_compressor_v3 import ModernPPTCompressor
+from ppt_compressor_v3 import ModernPPTCompressor, BatchManifest, ENCODER_BACKENDS, probe_backend
 
 
 class GlassButton(tk.Canvas):
@@ -417,6 +417,17 @@ class PPTCompressorGUI:
         self.log_text.see(tk.END)
         self.root.update_idletasks()
 
+    def queue_event(self, event, levels=None):
+        """压缩引擎的事件接收器：把日志文字放入消息队列，levels限制只显示哪些级别"""
+        if event.kind != 'message' or event.message is None:
+            return
+        if levels is not None and event.level not in levels:
+            return
+        tag = event.level if event.level in ('success', 'warning', 'error') else None
+        for line in event.message.split('\n'):
+            if line.strip():
+                self.message_queue.put(("log", line, tag))
+
     def clear_log(self):
         self.log_text.delete(1.0, tk.END)
         self.log("日志已清空", 'info')
@@ -435,17 +446,14 @@ class PPTCompressorGUI:
         except ImportError:
             self.log("✗ Pillow未安装", 'error')
 
-        import subprocess
-        try:
-            result = subprocess.run(['oxipng', '--version'],
-                                  capture_output=True, timeout=2, text=True)
-            if result.returncode == 0:
-                version = result.stdout.strip().split()[1] if len(result.stdout.split()) > 1 else ""
-                self.log(f"✓ oxipng: {version}", 'success')
+        for name, backend in ENCODER_BACKENDS.items():
+            if backend.version_command is None:
+                continue
+            version = probe_backend(name)
+            if version is not None:
+                self.log(f"✓ {name}: {version}", 'success')
             else:
-                raise Exception()
-        except:
-            self.log("⚠ oxipng未安装 (推荐)", 'warning')
+                self.log(f"⚠ {name}未安装 (推荐: {backend.install_hint})", 'warning')
 
         self.log("-" * 60)
 
@@ -482,25 +490,9 @@ class PPTCompressorGUI:
             self.message_queue.put(("log", f"开始压缩: {Path(input_file).name}", 'info'))
             self.message_queue.put(("log", f"压缩档位: {preset.upper()}", 'info'))
 
-            import io
-            from contextlib import redirect_stdout
-
-            f = io.StringIO()
-            with redirect_stdout(f):
-                compressor = ModernPPTCompressor(preset=preset)
-                compressor.compress_ppt(input_file, output_file)
-
-            output = f.getvalue()
-            for line in output.split('\n'):
-                if line.strip():
-                    tag = None
-                    if '✓' in line or '✅' in line:
-                        tag = 'success'
-                    elif '⚠' in line:
-                        tag = 'warning'
-                    elif '❌' in line:
-                        tag = 'error'
-                    self.message_queue.put(("log", line, tag))
+            # 引擎的事件直接进入消息队列，不捕获stdout，多个压缩任务同时运行也互不干扰
+            compressor = ModernPPTCompressor(preset=preset, sinks=[self.queue_event])
+            compressor.compress_ppt(input_file, output_file)
 
             self.message_queue.put(("log", "-" * 60, None))
             self.message_queue.put(("enable_button", None, None))
@@ -555,25 +547,31 @@ class PPTCompressorGUI:
             self.message_queue.put(("log", f"找到 {len(ppt_files)} 个文件", 'info'))
             self.message_queue.put(("log", "", None))
 
+            # 清单记录上次压缩过的文件，没有变化的直接跳过，中断后再次运行从中断处继续
+            manifest = BatchManifest(output_folder)
             success_count = 0
+            skipped_count = 0
             for i, ppt_file in enumerate(ppt_files, 1):
                 try:
                     self.message_queue.put(("log", f"[{i}/{len(ppt_files)}] {ppt_file.name}", 'info'))
 
                     output_file = Path(output_folder) / ppt_file.name
-
-                    import io
-                    from contextlib import redirect_stdout
-
-                    f = io.StringIO()
-                    with redirect_stdout(f):
-                        compressor = ModernPPTCompressor(preset=preset)
-                        compressor.compress_ppt(str(ppt_file), str(output_file))
-
-                    output = f.getvalue()
-                    for line in output.split('\n'):
-                        if '✅' in line or '减小' in line:
-                            self.message_queue.put(("log", line, 'success'))
+                    if manifest.is_current(ppt_file, output_file, preset):
+                        self.message_queue.put(("log", "  ⏭ 未改变，跳过", None))
+                        skipped_count += 1
+                        success_count += 1
+                        continue
+
+                    # 批量模式只显示成功和警告信息，最后显示总的减小量
+                    compressor = ModernPPTCompressor(
+                        preset=preset,
+                        sinks=[lambda event: self.queue_event(event, ('success', 'warning', 'error'))])
+                    result = compressor.compress_ppt(str(ppt_file), str(output_file))
+                    self.message_queue.put((
+                        "log", f"减小: {compressor.format_size(result.saved)} ({result.reduction * 100:.1f}%)",
+                        'success'))
+                    manifest.record(ppt_file, output_file, preset)
+                    manifest.save()
 
                     success_count += 1
                     self.message_queue.put(("log", "", None))
@@ -583,9 +581,9 @@ class PPTCompressorGUI:
                     self.message_queue.put(("log", "", None))
 
             self.message_queue.put(("log", "-" * 60, None))
-            self.message_queue.put(("log", f"✓ 完成! 成功: {success_count}/{len(ppt_files)}", 'success'))
+            self.message_queue.put(("log", f"✓ 完成! 成功: {success_count}/{len(ppt_files)}（跳过未改变的 {skipped_count} 个）", 'success'))
             self.message_queue.put(("enable_button", None, None))
-            self.message_queue.put(("show_success", f"批量压缩完成!\n成功: {success_count}/{len(ppt_files)}", None))
+            self.message_queue.put(("show_success", f"批量压缩完成!\n成功: {success_count}/{len(ppt_files)}\n跳过未改变: {skipped_count}", None))
 
         except Exception as e:
             self.message_queue.put(("log", f"❌ 失败: {str(e)}", 'error'))
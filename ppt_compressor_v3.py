@@ -9,12 +9,614 @@ PPT现代化无损压缩工具 v3.0
 import os
 import sys
 import zipfile
-import shutil
+import posixpath
+import re
+import math
+import xml.etree.ElementTree as ET
+from urllib.parse import quote, unquote
 from pathlib import Path
-from PIL import Image
+import PIL
+from PIL import Image, JpegImagePlugin, PngImagePlugin
+try:
+    import numpy as np
+except ImportError:  # NumPy是可选依赖，只用于加速图片分析
+    np = None
 import io
 import argparse
+import copy
+import random
 import subprocess
+import tempfile
+import hashlib
+import json
+import multiprocessing
+import struct
+import zlib
+import time
+import threading
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+
+
+# OOXML命名空间
+RELS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+# 重新序列化rels时使用默认命名空间，和PowerPoint的写法一致(而不是ns0:前缀)
+ET.register_namespace('', RELS_NS)
+NS = {
+    'a': 'http://schemas.openxmlformats.org/drawingml/2006/main',
+    'p': 'http://schemas.openxmlformats.org/presentationml/2006/main',
+    'r': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+}
+EMU_PER_INCH = 914400
+# 包含可以确定显示尺寸的图片(p:pic)的部件
+DISPLAY_PART_PATTERN = re.compile(
+    r'^ppt/(slides|slideLayouts|slideMasters|notesSlides|notesMasters|handoutMasters)/[^/]+\.xml$')
+
+
+def _rels_source_part(rels_name):
+    """ppt/slides/_rels/slide1.xml.rels -> ppt/slides/slide1.xml"""
+    rels_dir, rels_file = posixpath.split(rels_name)
+    return posixpath.join(posixpath.dirname(rels_dir), rels_file[:-len('.rels')])
+
+
+def _part_rels_name(part):
+    """ppt/slides/slide1.xml -> ppt/slides/_rels/slide1.xml.rels，包本身('')对应_rels/.rels"""
+    return posixpath.join(posixpath.dirname(part), '_rels', posixpath.basename(part) + '.rels')
+
+
+def _resolve_part_name(source_part, target):
+    """把关系中的Target解析为压缩包内的成员名"""
+    # 去掉指向部件内部位置的片段(#...)
+    target = unquote(target.split('#', 1)[0])
+    if target.startswith('/'):
+        return posixpath.normpath(target.lstrip('/'))
+    return posixpath.normpath(posixpath.join(posixpath.dirname(source_part), target))
+
+
+# 幻灯片中的一处图片引用：所在部件、rId、显示尺寸(EMU)、srcRect裁剪(l, t, r, b，单位1/100000)、是否拉伸填充
+PictureRef = namedtuple('PictureRef', 'part rid width height crop stretch')
+
+
+def _collect_pictures(root, part_name, image_rids):
+    """
+    遍历形状树，找出引用图片关系(rId)的所有图片(p:pic)
+
+    Returns:
+        ([PictureRef, ...], 已处理的a:blip元素集合)
+    """
+    a, p, r = NS['a'], NS['p'], NS['r']
+    pictures = []
+    handled = set()
+
+    def walk(element, scale_x, scale_y):
+        for child in element:
+            if child.tag == f'{{{p}}}grpSp':
+                # 组合形状内的子形状坐标需要按组合的缩放比例换算
+                child_x, child_y = scale_x, scale_y
+                xfrm = child.find(f'{{{p}}}grpSpPr/{{{a}}}xfrm')
+                if xfrm is not None:
+                    ext = xfrm.find(f'{{{a}}}ext')
+                    ch_ext = xfrm.find(f'{{{a}}}chExt')
+                    if ext is not None and ch_ext is not None:
+                        if int(ch_ext.get('cx', 0)) > 0:
+                            child_x *= int(ext.get('cx', 0)) / int(ch_ext.get('cx'))
+                        if int(ch_ext.get('cy', 0)) > 0:
+                            child_y *= int(ext.get('cy', 0)) / int(ch_ext.get('cy'))
+                walk(child, child_x, child_y)
+            elif child.tag == f'{{{p}}}pic':
+                blip = child.find(f'{{{p}}}blipFill/{{{a}}}blip')
+                ext = child.find(f'{{{p}}}spPr/{{{a}}}xfrm/{{{a}}}ext')
+                if blip is None or ext is None or blip.get(f'{{{r}}}embed') not in image_rids:
+                    continue
+                width = int(ext.get('cx', 0)) * scale_x
+                height = int(ext.get('cy', 0)) * scale_y
+                crop = (0, 0, 0, 0)
+                src_rect = child.find(f'{{{p}}}blipFill/{{{a}}}srcRect')
+                if src_rect is not None:
+                    crop = tuple(int(src_rect.get(side, 0)) for side in 'ltrb')
+                # 尺寸异常或整张图片都被裁掉的不处理
+                if width <= 0 or height <= 0 or crop[0] + crop[2] >= 100000 or crop[1] + crop[3] >= 100000:
+                    continue
+                stretch = child.find(f'{{{p}}}blipFill/{{{a}}}tile') is None
+                pictures.append(PictureRef(part_name, blip.get(f'{{{r}}}embed'),
+                                           width, height, crop, stretch))
+                handled.add(blip)
+            else:
+                walk(child, scale_x, scale_y)
+
+    try:
+        walk(root, 1.0, 1.0)
+    except ValueError:
+        # 尺寸属性异常时整个部件都不处理
+        return [], set()
+    return pictures, handled
+
+
+def _remove_element(xml_data, tag, attribute, value, flags=0):
+    """
+    删除属性等于指定值的自闭合元素，直接修改原始XML以保留命名空间前缀和其余内容
+
+    Returns:
+        (修改后的数据, 删除的数量)
+    """
+    pattern = re.compile(
+        rb'<' + re.escape(tag.encode('utf-8')) + rb'\s(?:[^>]*?\s)?' + re.escape(attribute.encode('utf-8'))
+        + rb'\s*=\s*["\']' + re.escape(value.encode('utf-8')) + rb'["\'][^>]*?/>', flags)
+    return pattern.subn(b'', xml_data)
+
+
+def _src_rect_pattern(rid):
+    """匹配引用rId的a:blip后面紧跟的自闭合a:srcRect"""
+    return re.compile(
+        rb'(<a:blip\s[^>]*?\br:embed=["\']' + re.escape(rid.encode('utf-8')) + rb'["\']'
+        rb'(?:[^>]*?/>|[^>]*?>(?:(?!</a:blip>).)*</a:blip>)\s*)<a:srcRect\b[^>]*?/>', re.S)
+
+
+def _clear_src_rects(xml_data, rids):
+    """把引用这些rId的图片的srcRect改为空，直接替换原始XML以保留命名空间前缀和其余内容"""
+    for rid in rids:
+        xml_data = _src_rect_pattern(rid).sub(rb'\1<a:srcRect/>', xml_data)
+    return xml_data
+
+
+def _ssim(reference, candidate, window=8):
+    """
+    两张同尺寸灰度图(NumPy数组)的平均SSIM
+
+    用积分图计算window×window的均值窗口，代替高斯窗口，全部向量化。
+    """
+    c1 = (0.01 * 255) ** 2
+    c2 = (0.03 * 255) ** 2
+    x = reference.astype(np.float64)
+    y = candidate.astype(np.float64)
+    window = min(window, *x.shape)
+
+    def box_mean(values):
+        integral = np.pad(values, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+        total = (integral[window:, window:] - integral[:-window, window:]
+                 - integral[window:, :-window] + integral[:-window, :-window])
+        return total / (window * window)
+
+    mu_x = box_mean(x)
+    mu_y = box_mean(y)
+    sigma_x = box_mean(x * x) - mu_x * mu_x
+    sigma_y = box_mean(y * y) - mu_y * mu_y
+    sigma_xy = box_mean(x * y) - mu_x * mu_y
+    ssim_map = ((2 * mu_x * mu_y + c1) * (2 * sigma_xy + c2)
+                / ((mu_x * mu_x + mu_y * mu_y + c1) * (sigma_x + sigma_y + c2)))
+    return float(ssim_map.mean())
+
+
+# 自由度1-30的Student t分布97.5%分位数，用于小样本的95%置信区间
+T_QUANTILES_975 = (12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+                   2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+                   2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042)
+
+
+def _t_quantile_975(df):
+    """Student t分布的97.5%分位数，超出表格范围时用正态分位数的一阶修正近似"""
+    if df <= len(T_QUANTILES_975):
+        return T_QUANTILES_975[df - 1]
+    z = 1.96
+    return z + (z ** 3 + z) / (4 * df)
+
+
+class EncoderBackend:
+    """
+    图片编码器后端
+
+    encode(compressor, image_data, filename, target_size, effort) 返回 compress_image 格式的结果，
+    返回None表示该编码器不适用或没有效果，继续尝试档位中的下一个编码器。
+    target_size是按显示尺寸算出的(宽, 高)像素上限，没有限制时为None；
+    PNG在交给编码器之前已经统一缩小，只有JPEG编码器需要处理它。
+    effort是时间预算分配的压缩力度(0-6，对应oxipng的优化级别)，None表示按档位设置。
+    """
+
+    def __init__(self, name, encode, version_command=None, install_hint=None):
+        """
+        Args:
+            name: 编码器名称，档位中的png_backends/jpeg_backends按名称引用
+            encode: 压缩函数
+            version_command: 探测可用性和版本的命令，None表示内置编码器总是可用
+            install_hint: 未安装时提示的安装方式
+        """
+        self.name = name
+        self.encode = encode
+        self.version_command = version_command
+        self.install_hint = install_hint
+
+    def probe(self):
+        """探测编码器版本，不可用时返回None"""
+        if self.version_command is None:
+            return 'builtin'
+        try:
+            result = subprocess.run(self.version_command, capture_output=True, timeout=2)
+        except Exception:
+            return None
+        if result.returncode != 0:
+            return None
+        # 有的工具把版本信息打印到stderr
+        output = (result.stdout or result.stderr).decode('utf-8', 'replace').strip()
+        return output.splitlines()[0] if output else 'unknown'
+
+
+# 已注册的编码器，名称 -> EncoderBackend
+ENCODER_BACKENDS = {}
+# 进程内缓存的探测结果，名称 -> 版本(不可用时为None)
+_backend_versions = {}
+# 已经提示过未安装的编码器
+_reported_backends = set()
+
+
+def register_backend(backend):
+    """注册编码器，同名的会被替换"""
+    ENCODER_BACKENDS[backend.name] = backend
+    _backend_versions.pop(backend.name, None)
+
+
+def probe_backend(name):
+    """返回编码器版本，不可用时返回None，每个进程只探测一次"""
+    if name not in _backend_versions:
+        _backend_versions[name] = ENCODER_BACKENDS[name].probe()
+    return _backend_versions[name]
+
+
+class TimeBudget:
+    """
+    按时间预算为每张图片分配压缩力度
+
+    力度就是oxipng的优化级别(0-6)。根据已完成图片的实测耗时估算剩余图片
+    在各级别下需要的时间，选择能在剩余时间内完成的最高级别；
+    预算用完、或者单张图片在最低级别下也预计无法在剩余时间内完成时，不再压缩这张图片。
+    正在压缩的单张图片无法中途停止，所以逐张压缩前要按估计耗时判断。
+    """
+
+    # 各级别每MB输入大约需要的CPU秒数，实测耗时只用来整体校正这个比例
+    SECONDS_PER_MB = {0: 0.05, 1: 0.1, 2: 0.3, 3: 0.5, 4: 0.8, 5: 1.5, 6: 3.0}
+    # 留给扫描和重新打包的预算比例
+    RESERVED_SHARE = 0.1
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds * (1 - self.RESERVED_SHARE)
+        self.speed_factor = 1.0
+
+    def remaining(self):
+        """图片压缩阶段剩余的秒数"""
+        return self.deadline - time.monotonic()
+
+    def choose_effort(self, pending_bytes, max_effort, workers, image_bytes=0):
+        """
+        选择压缩力度
+
+        Args:
+            pending_bytes: 包括本张在内、还没有压缩完的图片总大小
+            max_effort: 档位设置的最高力度
+            workers: 并行压缩的进程数
+            image_bytes: 本张图片的大小，本张必须能在剩余时间内单独完成
+
+        Returns:
+            压缩力度，预算已经用完或本张图片预计无法按时完成时返回None
+        """
+        remaining = self.remaining()
+        if remaining <= 0:
+            return None
+        capacity = remaining * workers
+        megabytes = pending_bytes / 1024 / 1024
+        image_megabytes = image_bytes / 1024 / 1024
+        for effort in range(max_effort, 0, -1):
+            seconds_per_mb = self.SECONDS_PER_MB[effort] * self.speed_factor
+            if megabytes * seconds_per_mb <= capacity and image_megabytes * seconds_per_mb <= remaining:
+                return effort
+        if image_megabytes * self.SECONDS_PER_MB[0] * self.speed_factor > remaining:
+            return None
+        return 0
+
+    def record(self, effort, size, elapsed):
+        """用一张图片的实测耗时校正速度估计"""
+        if effort is None or size <= 0:
+            return
+        expected = size / 1024 / 1024 * self.SECONDS_PER_MB[effort]
+        if expected > 0:
+            # 指数移动平均，避免单张图片的偶然耗时影响太大
+            self.speed_factor = 0.7 * self.speed_factor + 0.3 * (elapsed / expected)
+
+
+class Tracer:
+    """
+    记录压缩过程中各阶段和每张图片的耗时区间(span)
+
+    每个span记录名称、类别、开始时间、墙钟时间、进程CPU时间和附加信息(字节数、
+    像素数、编码器等)。子进程中记录的span由主进程合并，时间都取自time.perf_counter，
+    同一台机器上的进程之间可以直接比较。可以保存为Chrome trace格式，
+    用chrome://tracing或Perfetto查看。
+    """
+
+    def __init__(self):
+        self.spans = []
+        self.origin = time.perf_counter()
+        # 尚未结束的span，annotate补充信息到最内层的span
+        self._open = []
+
+    @contextmanager
+    def span(self, name, category='stage', **args):
+        """记录一个区间，yield出的args字典可以在区间内继续补充信息"""
+        record = {
+            'name': name,
+            'cat': category,
+            'start': time.perf_counter(),
+            'pid': os.getpid(),
+            'tid': threading.get_ident(),
+            'args': args,
+        }
+        cpu_start = self._cpu_time()
+        self._open.append(record)
+        try:
+            yield args
+        finally:
+            record['wall'] = time.perf_counter() - record['start']
+            record['cpu'] = self._cpu_time() - cpu_start
+            self._open.remove(record)
+            self.spans.append(record)
+
+    @staticmethod
+    def _cpu_time():
+        """本进程和已结束子进程(oxipng等外部编码器)的CPU时间"""
+        times = os.times()
+        return time.process_time() + times.children_user + times.children_system
+
+    def annotate(self, **args):
+        """给最内层尚未结束的span补充信息"""
+        if self._open:
+            self._open[-1]['args'].update(args)
+
+    def extend(self, spans):
+        """合并子进程记录的span"""
+        self.spans.extend(spans)
+
+    def summary(self):
+        """
+        按类别和名称汇总
+
+        Returns:
+            {类别: {名称: {'count': 次数, 'wall': 墙钟秒数, 'cpu': CPU秒数,
+                           'bytes_in': 输入字节, 'bytes_out': 输出字节}}}
+        """
+        summary = {}
+        for record in self.spans:
+            item = summary.setdefault(record['cat'], {}).setdefault(
+                record['name'], {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'bytes_in': 0, 'bytes_out': 0})
+            item['count'] += 1
+            item['wall'] += record['wall']
+            item['cpu'] += record['cpu']
+            item['bytes_in'] += record['args'].get('bytes_in') or 0
+            item['bytes_out'] += record['args'].get('bytes_out') or 0
+        return summary
+
+    def chrome_trace(self):
+        """转换为Chrome trace格式(JSON对象格式，时间单位为微秒)"""
+        events = []
+        for record in sorted(self.spans, key=lambda item: item['start']):
+            events.append({
+                'name': record['name'],
+                'cat': record['cat'],
+                'ph': 'X',
+                'ts': round((record['start'] - self.origin) * 1e6, 1),
+                'dur': round(record['wall'] * 1e6, 1),
+                'pid': record['pid'],
+                'tid': record['tid'],
+                'args': dict(record['args'], cpu_ms=round(record['cpu'] * 1000, 3)),
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms', 'summary': self.summary()}
+
+    def save(self, path):
+        """保存为Chrome trace JSON文件"""
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.chrome_trace(), f, ensure_ascii=False)
+
+
+class CompressionEvent(namedtuple('CompressionEvent', 'kind message level data')):
+    """
+    压缩过程中的事件，由ModernPPTCompressor发送给事件接收器(sink)
+
+    kind:
+        'message'        日志文字(message)，控制台输出的就是这些
+        'progress'       进度，data: percent
+        'image_started'  开始压缩一张图片，data: filename, original_size
+        'image_finished' 一张图片压缩完成，data: filename, original_size, compressed_size, encoder, success
+    level: 'info'、'success'、'warning'、'error'，界面按它选择显示样式
+    message: 给人看的文字，没有时为None
+    data: 附加信息字典
+    """
+
+
+def print_event(event):
+    """默认的事件接收器：把日志文字打印到控制台"""
+    if event.kind == 'message' and event.message is not None:
+        print(event.message)
+
+
+# compress_ppt返回值中每张图片的结果，encoder为None表示保持原样
+ImageResult = namedtuple('ImageResult', 'member original_size compressed_size encoder')
+
+
+class CompressionResult(namedtuple('CompressionResult',
+                                   'input_path output_path input_size output_size images elapsed')):
+    """compress_ppt的返回值，images是按原顺序排列的[ImageResult]，重复图片只有第一个成员"""
+
+    @property
+    def saved(self):
+        """减小的字节数"""
+        return self.input_size - self.output_size
+
+    @property
+    def reduction(self):
+        """减小的比例(0-1)"""
+        return self.saved / self.input_size if self.input_size else 0.0
+
+    @property
+    def compressed_count(self):
+        """压缩成功的图片数量"""
+        return sum(1 for image in self.images if image.encoder is not None)
+
+
+class CompressionCache:
+    """
+    磁盘上的图片压缩结果缓存
+
+    以内容哈希为键，每个条目一个文件：第一行是JSON元数据，其后是压缩后的数据。
+    读取时刷新文件修改时间，淘汰时按修改时间删除最久未使用的条目。
+    多个进程可以同时读写，写入先写临时文件再原子替换。
+    """
+
+    DEFAULT_MAX_SIZE = 1024 * 1024 * 1024  # 1GB
+
+    def __init__(self, cache_dir, max_size=DEFAULT_MAX_SIZE):
+        self.cache_dir = Path(cache_dir).expanduser()
+        self.max_size = max_size
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def _entry_path(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key):
+        """
+        读取缓存条目
+
+        Returns:
+            (压缩后的数据, 新扩展名, 是否成功)，未命中时返回None
+        """
+        path = self._entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                meta = json.loads(f.readline())
+                data = f.read()
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data, meta['ext'], meta['success']
+
+    def put(self, key, data, new_ext, success):
+        """写入缓存条目，失败时静默忽略"""
+        path = self._entry_path(key)
+        try:
+            path.parent.mkdir(exist_ok=True)
+            tmp_path = path.with_name(f"{key}.{os.getpid()}.tmp")
+            with open(tmp_path, 'wb') as f:
+                f.write(json.dumps({'ext': new_ext, 'success': success}).encode('utf-8') + b'\n')
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    def evict(self):
+        """缓存超过大小上限时，删除最久未使用的条目，直到降到上限的90%"""
+        entries = []
+        total_size = 0
+        for path in self.cache_dir.glob('*/*'):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total_size += stat.st_size
+
+        if total_size <= self.max_size:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total_size <= self.max_size * 0.9:
+                break
+            try:
+                path.unlink()
+                total_size -= size
+            except OSError:
+                pass
+
+
+
+def _file_sha256(path):
+    """文件内容的SHA-256，分块读取"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class BatchManifest:
+    """
+    批量压缩的清单，保存在输出文件夹中
+
+    每个输入文件记录大小、修改时间、内容哈希、档位和输出文件的哈希。
+    大小和修改时间都没变时直接认为内容没变，否则再比较内容哈希；
+    输出文件被删除或改动过时重新压缩。每压缩完一个文件就保存一次，
+    批量压缩中断后再次运行会从中断的地方继续。
+    """
+
+    FILENAME = '.ppt_compressor_manifest.json'
+    VERSION = 1
+
+    def __init__(self, folder):
+        self.path = Path(folder) / self.FILENAME
+        self.entries = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == self.VERSION:
+                self.entries = data.get('entries', {})
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def _key(input_path):
+        return str(Path(input_path).resolve())
+
+    def is_current(self, input_path, output_path, preset):
+        """输入文件和档位都没变、输出文件也还是上次的结果时返回True"""
+        entry = self.entries.get(self._key(input_path))
+        output_path = Path(output_path)
+        if entry is None or entry['preset'] != preset or entry['output'] != str(output_path.resolve()):
+            return False
+        try:
+            stat = Path(input_path).stat()
+            output_stat = output_path.stat()
+        except OSError:
+            return False
+
+        if (stat.st_size, stat.st_mtime_ns) != (entry['size'], entry['mtime_ns']):
+            if stat.st_size != entry['size'] or _file_sha256(input_path) != entry['sha256']:
+                return False
+            # 内容没变，只是修改时间变了(例如重新复制过)
+            entry['mtime_ns'] = stat.st_mtime_ns
+        if (output_stat.st_size, output_stat.st_mtime_ns) != (entry['output_size'], entry['output_mtime_ns']):
+            if output_stat.st_size != entry['output_size'] or _file_sha256(output_path) != entry['output_sha256']:
+                return False
+            entry['output_mtime_ns'] = output_stat.st_mtime_ns
+        return True
+
+    def record(self, input_path, output_path, preset):
+        """记录一个压缩完成的文件"""
+        stat = Path(input_path).stat()
+        output_stat = Path(output_path).stat()
+        self.entries[self._key(input_path)] = {
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': _file_sha256(input_path),
+            'preset': preset,
+            'output': str(Path(output_path).resolve()),
+            'output_size': output_stat.st_size,
+            'output_mtime_ns': output_stat.st_mtime_ns,
+            'output_sha256': _file_sha256(output_path),
+        }
+
+    def save(self):
+        """先写临时文件再原子替换，保存过程中中断也不会损坏已有的清单"""
+        tmp_path = self.path.with_name(f"{self.FILENAME}.{os.getpid()}.tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': self.VERSION, 'entries': self.entries}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
 
 
 class ModernPPTCompressor:
@@ -27,30 +629,38 @@ class ModernPPTCompressor:
             'png_quality': 'max',  # oxipng最大压缩
             'jpeg_quality': 95,
             'preserve_transparency': True,
-            'use_oxipng': True,
+            'png_backends': ['oxipng', 'pillow'],
+            'jpeg_backends': ['jpegtran'],  # JPEG只做无损优化，不解码重编码
+            'jpeg_lossless': True,
         },
         'high': {
             'desc': '高质量 - 视觉无损，压缩率30-50%',
             'png_quality': 'high',
             'jpeg_quality': 90,
             'preserve_transparency': True,
-            'use_oxipng': True,
+            'png_backends': ['oxipng', 'pillow'],
+            'jpeg_backends': ['jpegtran', 'cjpeg', 'pillow'],
+            'target_dpi': 300,  # 按幻灯片中的显示尺寸限制分辨率
         },
         'balanced': {
             'desc': '平衡模式 - 轻微损失，压缩率50-70%',
             'png_quality': 'medium',
             'jpeg_quality': 85,
             'preserve_transparency': True,
-            'use_oxipng': True,
+            'png_backends': ['oxipng', 'pillow'],
+            'jpeg_backends': ['jpegtran', 'cjpeg', 'pillow'],
             'max_dimension': 2560,
+            'target_dpi': 220,
         },
         'aggressive': {
             'desc': '激进PNG压缩 - 保留PNG格式和透明度，压缩率70-85%',
             'png_quality': 'aggressive',  # 激进PNG压缩
             'jpeg_quality': 80,
             'preserve_transparency': True,  # 保留透明度
-            'use_oxipng': True,  # 使用oxipng
+            'png_backends': ['pngquant', 'oxipng', 'pillow'],  # 按顺序尝试的PNG编码器
+            'jpeg_backends': ['jpegtran', 'cjpeg', 'pillow'],
             'max_dimension': 1280,  # 限制尺寸
+            'target_dpi': 150,
             'reduce_colors': True,  # 降低颜色数量
         },
         'small': {
@@ -58,8 +668,10 @@ class ModernPPTCompressor:
             'png_quality': 'low',
             'jpeg_quality': 75,
             'preserve_transparency': True,  # 保留PNG透明度
-            'use_oxipng': True,  # 使用oxipng
+            'png_backends': ['pngquant', 'oxipng', 'pillow'],  # 按顺序尝试的PNG编码器
+            'jpeg_backends': ['jpegtran', 'cjpeg', 'pillow'],
             'max_dimension': 1920,
+            'target_dpi': 150,
             'reduce_colors': True,  # 降低颜色数量
         },
         'mini': {
@@ -67,130 +679,676 @@ class ModernPPTCompressor:
             'png_quality': 'aggressive',  # 使用激进PNG压缩
             'jpeg_quality': 65,
             'preserve_transparency': True,  # 保留PNG透明度
-            'use_oxipng': True,  # 使用oxipng
+            'png_backends': ['pngquant', 'oxipng', 'pillow'],  # 按顺序尝试的PNG编码器
+            'jpeg_backends': ['jpegtran', 'cjpeg', 'pillow'],
             'max_dimension': 1280,
+            'target_dpi': 96,
             'reduce_colors': True,  # 降低颜色数量
         }
     }
     
-    def __init__(self, preset='balanced'):
-        """初始化压缩器"""
+    # 本身已经是压缩格式的媒体文件，重新打包时直接存储(STORED)，不再deflate
+    STORED_EXTENSIONS = {
+        '.jpg', '.jpeg', '.png', '.gif', '.wdp', '.webp',
+        '.mp4', '.m4v', '.mov', '.wmv', '.mp3', '.m4a', '.wma',
+        '.zip', '.docx', '.xlsx', '.pptx',
+    }
+    
+    # 需要oxipng处理的PNG达到这个数量时改为批量调用oxipng
+    OXIPNG_BATCH_MIN = 4
+    # 批量压缩时oxipng处理单张图片的超时秒数
+    OXIPNG_TIMEOUT = 30
+    # PNG压缩档位对应的oxipng优化级别，也是时间预算模式下的最高压缩力度
+    OXIPNG_LEVELS = {'max': 6, 'aggressive': 6, 'high': 4}
+    # 预估模式默认抽样压缩的图片数量
+    ESTIMATE_SAMPLE_SIZE = 8
+    # 预估模式每层至少抽样的图片数量，样本太少时t分位数很大，置信区间没有意义
+    ESTIMATE_MIN_PER_STRATUM = 5
+    # SSIM质量搜索：最低质量、最多尝试次数、计算SSIM的最大像素数
+    MIN_SSIM_QUALITY = 40
+    SSIM_SEARCH_STEPS = 5
+    SSIM_MAX_PIXELS = 1024 * 1024
+    # 目标大小模式的压缩级别，从温和到激进：(JPEG质量的降低值, 分辨率缩放比例)
+    TARGET_SIZE_LEVELS = [(-10, 1.0), (-20, 1.0), (-25, 0.85), (-30, 0.7), (-35, 0.55), (-40, 0.4), (-45, 0.3)]
+    MIN_TARGET_QUALITY = 20
+    # 估算解码内存：解码后的像素、模式转换和缩放的副本、编码缓冲区，约为解码大小的几倍
+    DECODE_OVERHEAD = 3
+    # 转换格式后新扩展名对应的内容类型
+    CONTENT_TYPES = {
+        'png': 'image/png',
+        'jpg': 'image/jpeg',
+        'jpeg': 'image/jpeg',
+        'gif': 'image/gif',
+        'bmp': 'image/bmp',
+        'tif': 'image/tiff',
+        'tiff': 'image/tiff',
+    }
+    # 每次oxipng调用最多处理的文件数，避免命令行过长
+    OXIPNG_BATCH_SIZE = 256
+    
+    def __init__(self, preset='balanced', workers=None, compresslevel=6,
+                 merge_duplicates=False, cache_dir=None, cache_size=CompressionCache.DEFAULT_MAX_SIZE,
+                 oxipng_batch=True, fast_resize=True, target_dpi=None, apply_crops=False,
+                 prune_orphans=True, prune_layouts=False, time_budget=None, target_file_size=None,
+                 ssim_threshold=None, memory_limit=None, sinks=None):
+        """
+        初始化压缩器
+
+        Args:
+            preset: 压缩档位
+            workers: 并行压缩图片的进程数和重新打包时并行deflate的线程数，默认为CPU核心数，1表示串行
+            compresslevel: 重新打包时XML等文本成员的deflate压缩级别(0-9)
+            merge_duplicates: 是否把内容相同的图片合并为一个成员，并改写引用
+            cache_dir: 压缩结果缓存目录，None表示不使用缓存
+            cache_size: 缓存目录的大小上限(字节)，超出后按最近最少使用淘汰
+            oxipng_batch: PNG较多时是否用一次oxipng调用批量压缩
+            fast_resize: 缩小JPEG时是否先让解码器按比例缩放解码(draft模式)
+            target_dpi: 按幻灯片显示尺寸限制图片分辨率时的目标DPI，None使用档位设置，0表示不限制
+            apply_crops: 是否按图片的裁剪区域(srcRect)裁掉不可见的部分
+            prune_orphans: 是否删除没有被任何关系引用的部件
+            prune_layouts: 是否同时删除没有幻灯片使用的版式和母版
+            time_budget: 整个压缩过程的时间预算(秒，大于0的有限值)，按剩余时间降低压缩力度，None表示不限制
+            target_file_size: 目标文件大小(字节)，超出时自动降低质量和分辨率，None表示不限制
+            ssim_threshold: 按SSIM为每张JPEG选择质量的阈值(例如0.98)，档位质量作为上限，None表示使用固定质量
+            memory_limit: 图片解码和压缩的内存上限(字节)，按图片头估算内存，并行压缩时只在上限内同时处理，
+                          单张超过上限的图片保持原样，None表示不限制
+            sinks: 事件接收器列表，每个是 sink(CompressionEvent)，默认[print_event]打印到控制台
+        """
+        self.sinks = [print_event] if sinks is None else list(sinks)
         if preset in self.PRESETS:
             config = self.PRESETS[preset]
             self.preset_name = preset
             self.png_quality = config.get('png_quality')
             self.jpeg_quality = config.get('jpeg_quality', 85)
             self.preserve_transparency = config.get('preserve_transparency', True)
-            self.use_oxipng = config.get('use_oxipng', False)
+            self.png_backends = config.get('png_backends', ['pillow'])
+            self.jpeg_backends = config.get('jpeg_backends', ['pillow'])
+            self.jpeg_lossless = config.get('jpeg_lossless', False)
             self.max_dimension = config.get('max_dimension')
+            self.target_dpi = config.get('target_dpi') if target_dpi is None else target_dpi
             self.reduce_colors = config.get('reduce_colors', False)  # 新增：是否降低颜色数量
+            self.max_effort = self.OXIPNG_LEVELS.get(self.png_quality, 2)
         else:
             raise ValueError(f"未知的预设档位: {preset}")
         
         self.image_extensions = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.tif'}
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.compresslevel = compresslevel
+        self.merge_duplicates = merge_duplicates
+        self.cache = CompressionCache(cache_dir, cache_size) if cache_dir else None
+        self.oxipng_batch = oxipng_batch
+        self.fast_resize = fast_resize
+        self.apply_crops = apply_crops
+        self.prune_orphans = prune_orphans
+        self.prune_layouts = prune_layouts
+        if time_budget is not None and not (math.isfinite(time_budget) and time_budget > 0):
+            raise ValueError(f"时间预算必须是大于0的有限秒数: {time_budget}")
+        self.time_budget = time_budget
+        self.target_file_size = target_file_size
+        self.ssim_threshold = ssim_threshold
+        self.memory_limit = memory_limit
+        # compress_ppt运行期间的Tracer，不记录时为None
+        self.tracer = None
+        # compress_image正在处理(或刚处理完)的图片实际使用的编码器，没有压缩成功时为None
+        self._encoder = None
+        # 有时间预算时图片压缩的截止时间(time.monotonic)，编码器的超时不超过这个时间
+        self._deadline = None
+        # 当前图片的压缩是否被截止时间或编码器超时打断，打断的结果不写入缓存
+        self._cut_short = False
+        if ssim_threshold and np is None:
+            self._emit('message', "⚠️  未安装NumPy，无法按SSIM选择JPEG质量，将使用档位的固定质量", level='warning')
+            self._emit('message', "   安装方式: pip install numpy", level='warning')
         
-        # 检查是否安装了oxipng
-        self.has_oxipng = self._check_oxipng()
-        if self.use_oxipng and not self.has_oxipng:
-            print("⚠️  oxipng未安装，将使用Pillow进行PNG压缩")
-            print("   建议安装oxipng获得更好的PNG压缩: brew install oxipng")
-    
-    def _check_oxipng(self):
-        """检查oxipng是否安装"""
-        try:
-            result = subprocess.run(['oxipng', '--version'], 
-                                  capture_output=True, 
-                                  timeout=2)
-            return result.returncode == 0
-        except:
-            return False
+        # 检查档位用到的编码器是否可用，探测结果在进程内缓存，子进程直接沿用这里的结果
+        self.backend_versions = {}
+        for name in self.png_backends + self.jpeg_backends:
+            if name not in ENCODER_BACKENDS:
+                raise ValueError(f"未知的编码器: {name}")
+            version = probe_backend(name)
+            self.backend_versions[name] = version
+            if version is None and name not in _reported_backends:
+                # 每个进程只提示一次，批量处理和预估多个档位时不重复输出
+                _reported_backends.add(name)
+                backend = ENCODER_BACKENDS[name]
+                self._emit('message', f"⚠️  {name}未安装，将跳过该编码器", level='warning')
+                if backend.install_hint:
+                    self._emit('message', f"   建议安装{name}获得更好的压缩效果: {backend.install_hint}", level='warning')
+        self.use_oxipng = 'oxipng' in self.png_backends
+        self.has_oxipng = self.backend_versions.get('oxipng') is not None
     
     def is_image_file(self, filename):
         """判断是否为图片文件"""
         return Path(filename).suffix.lower() in self.image_extensions
     
-    def _compress_png_with_oxipng(self, input_path, output_path):
-        """使用oxipng进行真正的无损PNG压缩"""
+    def _oxipng_args(self, effort=None):
+        """根据PNG压缩档位生成oxipng的优化参数，effort限制优化级别的上限"""
+        # oxipng参数：-o max(即6)表示最大压缩，--strip safe删除安全的元数据
+        level = self.max_effort if effort is None else min(self.max_effort, effort)
+        args = ['-o', 'max' if level >= 6 else str(level), '--strip', 'safe']
+        if self.png_quality == 'aggressive':
+            # 激进模式：最大压缩 + alpha优化
+            args.append('--alpha')
+        return args
+
+    def _encoder_timeout(self, default=30):
+        """编码器子进程的超时秒数，有时间预算时不超过剩余时间"""
+        if self._deadline is None:
+            return default
+        return max(0.1, min(default, self._deadline - time.monotonic()))
+
+    def _run_encoder(self, args, input_data=None, timeout=None):
+        """运行编码器子进程，超时时记录本次结果不完整(不写入缓存)后继续抛出异常"""
         try:
-            # oxipng参数：-o max表示最大压缩，--strip safe删除安全的元数据
-            if self.png_quality == 'max':
-                args = ['oxipng', '-o', 'max', '--strip', 'safe', input_path, '-o', output_path]
-            elif self.png_quality == 'high':
-                args = ['oxipng', '-o', '4', '--strip', 'safe', input_path, '-o', output_path]
-            elif self.png_quality == 'aggressive':
-                # 激进模式：最大压缩 + 强制8位 + alpha优化
-                args = ['oxipng', '-o', 'max', '--strip', 'safe', '--alpha', input_path, '-o', output_path]
-            else:  # medium
-                args = ['oxipng', '-o', '2', '--strip', 'safe', input_path, '-o', output_path]
-            
-            result = subprocess.run(args, capture_output=True, timeout=30)
-            return result.returncode == 0
+            return subprocess.run(args, input=input_data, capture_output=True,
+                                  timeout=timeout or self._encoder_timeout())
+        except subprocess.TimeoutExpired:
+            self._cut_short = True
+            raise
+    
+    def _available_backends(self, filename):
+        """该图片按顺序可以尝试的编码器名称"""
+        ext = Path(filename).suffix.lower()
+        if ext == '.png':
+            names = self.png_backends
+        elif ext in {'.jpg', '.jpeg'}:
+            names = self.jpeg_backends
+        else:
+            return []
+        return [name for name in names if self.backend_versions.get(name) is not None]
+    
+    def _uses_oxipng(self, filename):
+        """该图片是否首先走oxipng压缩"""
+        backends = self._available_backends(filename)
+        return (Path(filename).suffix.lower() == '.png' and bool(backends)
+                and backends[0] == 'oxipng' and self.preserve_transparency)
+    
+    def _compress_png_with_oxipng(self, image_data, effort=None):
+        """
+        使用oxipng进行真正的无损PNG压缩，通过stdin/stdout传输数据，不落盘
+
+        Returns:
+            压缩后的PNG数据，失败时返回None
+        """
+        try:
+            args = ['oxipng'] + self._oxipng_args(effort)
+            oxipng_timeout = None
+            if self._deadline is not None:
+                # 超时后oxipng输出已经找到的最好结果，而不是被强制结束
+                oxipng_timeout = max(1, int(self._encoder_timeout()))
+                args += ['--timeout', str(oxipng_timeout)]
+            start = time.monotonic()
+            result = self._run_encoder(args + ['--stdout', '-'], image_data)
+            if oxipng_timeout is not None and time.monotonic() - start >= oxipng_timeout:
+                # 达到--timeout时输出的不是完整优化的结果
+                self._cut_short = True
+            if result.returncode == 0 and result.stdout:
+                return result.stdout
+            return None
         except Exception as e:
-            print(f"  ⚠️  oxipng压缩失败: {e}")
-            return False
+            self._emit('message', f"  ⚠️  oxipng压缩失败: {e}", level='warning')
+            return None
+    
+    def _compress_pngs_with_oxipng_batch(self, images, threads):
+        """
+        用一次oxipng调用批量压缩多张PNG，由oxipng自己的多线程并行处理
+
+        图片写入系统临时目录，输出到另一个目录后按序号取回，
+        避免每张图片启动一个进程。
+
+        Args:
+            images: [(文件名, 图片数据), ...]
+            threads: oxipng使用的线程数
+
+        任何一批达到单张图片的--timeout或者整体超时，都把_cut_short设为True，
+        这时的结果不是完整优化的，调用方不应写入缓存。
+
+        Returns:
+            与images一一对应的压缩后数据列表，没有输出的为None
+        """
+        results = [None] * len(images)
+        try:
+            with tempfile.TemporaryDirectory(prefix='ppt_compressor_') as work_dir:
+                in_dir = Path(work_dir) / 'in'
+                out_dir = Path(work_dir) / 'out'
+                in_dir.mkdir()
+                out_dir.mkdir()
+
+                for start in range(0, len(images), self.OXIPNG_BATCH_SIZE):
+                    chunk = range(start, min(start + self.OXIPNG_BATCH_SIZE, len(images)))
+                    paths = []
+                    for index in chunk:
+                        path = in_dir / f"{index}.png"
+                        path.write_bytes(images[index][1])
+                        paths.append(str(path))
+
+                    args = (['oxipng'] + self._oxipng_args()
+                            + ['--threads', str(threads), '--timeout', str(self.OXIPNG_TIMEOUT),
+                               '--dir', str(out_dir)]
+                            + paths)
+                    # 单张图片的耗时由--timeout限制，这里只防止进程卡死
+                    chunk_start = time.monotonic()
+                    self._run_encoder(args, timeout=60 + self.OXIPNG_TIMEOUT * len(paths) / threads)
+                    if time.monotonic() - chunk_start >= self.OXIPNG_TIMEOUT:
+                        # 可能有图片达到了--timeout
+                        self._cut_short = True
+
+                    for index in chunk:
+                        out_path = out_dir / f"{index}.png"
+                        if out_path.exists():
+                            results[index] = out_path.read_bytes()
+        except Exception as e:
+            self._emit('message', f"  ⚠️  oxipng批量压缩失败: {e}", level='warning')
+        return results
     
-    def compress_image(self, image_data, filename, file_path):
+    def compress_image(self, image_data, filename, file_path=None, *, skip_oxipng=False, target_size=None,
+                       effort=None):
         """
-        压缩单张图片 - 完全保留PNG透明度
+        压缩单张图片 - 完全保留PNG透明度，启用缓存时先查缓存
         
         Args:
             image_data: 原始图片数据
             filename: 文件名
-            file_path: 文件完整路径
+            file_path: 已不再使用，只为兼容旧的位置参数调用而保留
+            skip_oxipng: 已经用oxipng批量压缩过但没有效果，直接使用Pillow
+            target_size: 按幻灯片中显示尺寸算出的(宽, 高)像素上限，None表示不限制
+            effort: 时间预算分配的压缩力度(0-6)，None表示按档位设置
             
         Returns:
             (压缩后的图片数据, 新文件名, 是否成功)
         """
+        self._emit('image_started', filename=filename, original_size=len(image_data))
+        self._encoder = None
+        self._cut_short = False
+        with self._trace('image', 'image', filename=filename, bytes_in=len(image_data)) as span:
+            cached = None
+            if self.cache is not None:
+                cache_key = self._cache_key(image_data, filename, target_size, effort)
+                cached = self._get_cached(cache_key, image_data, filename)
+            if cached is not None:
+                result = cached
+                span['cached'] = True
+                self._encoder = 'cache'
+            elif self._exceeds_memory_limit(image_data, target_size):
+                # 不写入缓存，内存上限不同时可能可以压缩
+                self._emit('message', f"  ⚠️  {filename}: 解码需要的内存超过上限，保持原样", level='warning')
+                result = image_data, filename, False
+            else:
+                result = self._compress_image(image_data, filename, skip_oxipng, target_size, effort)
+                # 被截止时间或超时打断的结果不代表这组参数能达到的效果，不写入缓存
+                if self.cache is not None and not self._cut_short:
+                    self._put_cached(cache_key, result)
+            if self.tracer is not None:
+                compressed_data, _, success = result
+                span['bytes_out'] = len(compressed_data) if success else len(image_data)
+                span['success'] = success
+                try:
+                    width, height = Image.open(io.BytesIO(image_data)).size
+                    span['pixels'] = width * height
+                except Exception:
+                    pass
+        compressed_data, _, success = result
+        self._encoder = (self._encoder or 'pillow') if success else None
+        self._emit('image_finished', filename=filename, original_size=len(image_data),
+                   compressed_size=len(compressed_data) if success else len(image_data),
+                   encoder=self._encoder, success=success)
+        return result
+
+    def _emit(self, kind, message=None, level='info', **data):
+        """发送事件给所有接收器"""
+        event = CompressionEvent(kind, message, level, data)
+        for sink in self.sinks:
+            sink(event)
+
+    def _note_encoder(self, name):
+        """记录当前图片实际使用的编码器"""
+        self._encoder = name
+        self._trace_annotate(encoder=name)
+
+    def _trace(self, name, category='stage', **args):
+        """没有Tracer时返回空的上下文，调用方不用判断是否在记录"""
+        if self.tracer is None:
+            return nullcontext({})
+        return self.tracer.span(name, category, **args)
+
+    def _trace_annotate(self, **args):
+        """给当前的span补充信息"""
+        if self.tracer is not None:
+            self.tracer.annotate(**args)
+
+    def _get_cached(self, cache_key, image_data, filename):
+        """读取缓存的压缩结果，未命中时返回None"""
+        cached = self.cache.get(cache_key)
+        if cached is None:
+            return None
+        compressed_data, new_ext, success = cached
+        if not success:
+            return image_data, filename, False
+        original_size = len(image_data)
+        saved = original_size - len(compressed_data)
+        self._emit('message', f"  ✓ [缓存] {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)", level='success')
+        return compressed_data, str(Path(filename).with_suffix(new_ext)), True
+
+    def _put_cached(self, cache_key, result):
+        """把compress_image的结果写入缓存"""
+        compressed_data, new_filename, success = result
+        self.cache.put(cache_key, compressed_data if success else b'',
+                       Path(new_filename).suffix, success)
+
+    def _cache_key(self, image_data, filename, target_size=None, effort=None):
+        """缓存键：图片内容哈希 + 影响压缩结果的参数 + 编码器版本"""
+        params = {
+            'ext': Path(filename).suffix.lower(),
+            'png_quality': self.png_quality,
+            'jpeg_quality': self.jpeg_quality,
+            'jpeg_lossless': self.jpeg_lossless,
+            'preserve_transparency': self.preserve_transparency,
+            'backends': self.backend_versions,
+            'max_dimension': self.max_dimension,
+            'target_size': target_size,
+            'effort': effort,
+            'ssim_threshold': self.ssim_threshold,
+            # 设置了内存上限时总是使用draft模式，缓存键记录实际生效的设置
+            'fast_resize': self.fast_resize or bool(self.memory_limit),
+            'reduce_colors': self.reduce_colors,
+            'pillow': PIL.__version__,
+        }
+        digest = hashlib.sha256(image_data)
+        digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _compress_image(self, image_data, filename, skip_oxipng=False, target_size=None, effort=None):
+        """压缩单张图片，不经过缓存，按档位配置的顺序尝试各个编码器"""
         try:
-            original_size = len(image_data)
             ext = Path(filename).suffix.lower()
-            
-            # PNG文件特殊处理 - 优先使用oxipng保留透明度
+            if ext not in {'.png', '.jpg', '.jpeg'}:
+                self._note_encoder('pillow')
+                return self._compress_other(image_data, filename, target_size)
+
+            # oxipng、pngquant不能缩放，PNG先统一缩小到目标尺寸再交给编码器
+            work_data = image_data
             if ext == '.png':
-                if self.use_oxipng and self.has_oxipng and self.preserve_transparency:
-                    # 使用oxipng进行真正的无损压缩
-                    temp_input = file_path
-                    temp_output = file_path + '.tmp'
-                    
-                    if self._compress_png_with_oxipng(temp_input, temp_output):
-                        if os.path.exists(temp_output):
-                            with open(temp_output, 'rb') as f:
-                                compressed_data = f.read()
-                            os.remove(temp_output)
-                            
-                            if len(compressed_data) < original_size:
-                                print(f"  ✓ [oxipng] {filename}: 减小 {self.format_size(original_size - len(compressed_data))} ({((original_size - len(compressed_data))/original_size*100):.1f}%)")
-                                return compressed_data, filename, True
-                
-                # 如果不使用oxipng或失败，使用Pillow
-                return self._compress_png_with_pillow(image_data, filename)
-            
-            # JPEG文件优化
-            elif ext in {'.jpg', '.jpeg'}:
-                return self._compress_jpeg(image_data, filename)
-            
-            # 其他格式
-            else:
-                return self._compress_other(image_data, filename)
+                work_data = self._downscale_png(image_data, filename, target_size) or image_data
+
+            result = None
+            for name in self._available_backends(filename):
+                if name == 'oxipng' and skip_oxipng:
+                    continue
+                if self._deadline is not None and time.monotonic() >= self._deadline:
+                    # 时间预算已用完，不再尝试后面的编码器
+                    self._cut_short = True
+                    break
+                with self._trace(name, 'encoder', filename=filename, bytes_in=len(work_data)) as span:
+                    result = ENCODER_BACKENDS[name].encode(self, work_data, filename, target_size, effort)
+                    if result is not None:
+                        span['bytes_out'] = len(result[0])
+                if result is not None:
+                    self._note_encoder(name)
+                    break
+            return self._finish_downscaled(result, image_data, work_data, filename)
                 
         except Exception as e:
-            print(f"  ⚠️  压缩图片失败 {filename}: {str(e)}")
+            self._emit('message', f"  ⚠️  压缩图片失败 {filename}: {str(e)}", level='warning')
             return image_data, filename, False
     
+    def _downscale_png(self, image_data, filename, target_size=None):
+        """
+        把PNG缩小到max_dimension和target_size限制的尺寸
+
+        Returns:
+            缩小后的PNG数据(低压缩级别，留给后面的编码器压缩)，不需要缩小时返回None
+        """
+        img = Image.open(io.BytesIO(image_data))
+        new_size = self._target_dimensions(img.width, img.height, target_size)
+        if new_size is None:
+            return None
+        with self._trace('resize', 'pillow', filename=filename, pixels=img.width * img.height):
+            if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+                img = img.convert('RGBA')
+            resized = img.resize(new_size, Image.Resampling.LANCZOS)
+            output = io.BytesIO()
+            resized.save(output, format='PNG', compress_level=1)
+        self._emit('message', f"  📐 {filename}: {img.width}x{img.height} → {new_size[0]}x{new_size[1]}")
+        return output.getvalue()
+    
+    def _finish_downscaled(self, result, image_data, work_data, filename):
+        """
+        整理编码器结果：PNG被预先缩小时，编码器没有进一步压缩也使用缩小后的数据，
+        并且与原图比较大小
+        """
+        if work_data is image_data:
+            return result if result is not None else (image_data, filename, False)
+        compressed_data, new_filename, success = result if result is not None else (work_data, filename, False)
+        if not success:
+            compressed_data, new_filename = work_data, filename
+        if len(compressed_data) < len(image_data):
+            return compressed_data, new_filename, True
+        return image_data, filename, False
+    
+    def _encode_pillow(self, image_data, filename, target_size=None, effort=None):
+        """Pillow编码器：总是返回结果，作为档位中最后的兜底"""
+        if Path(filename).suffix.lower() == '.png':
+            return self._compress_png_with_pillow(image_data, filename)
+        return self._compress_jpeg(image_data, filename, target_size)
+    
+    def _encode_oxipng(self, image_data, filename, target_size=None, effort=None):
+        """oxipng编码器：只在保留透明度且确实变小时返回结果"""
+        if not self.preserve_transparency:
+            return None
+        original_size = len(image_data)
+        compressed_data = self._compress_png_with_oxipng(image_data, effort)
+        if compressed_data and len(compressed_data) < original_size:
+            self._emit('message', f"  ✓ [oxipng] {filename}: 减小 {self.format_size(original_size - len(compressed_data))} ({((original_size - len(compressed_data))/original_size*100):.1f}%)", level='success')
+            return compressed_data, filename, True
+        return None
+    
+    def _encode_pngquant(self, image_data, filename, target_size=None, effort=None):
+        """pngquant编码器：有损调色板量化，保留透明度，达不到质量要求时返回None"""
+        try:
+            # 时间预算紧张时使用最快的量化速度
+            speed = '3' if effort is None or effort >= 2 else '10'
+            result = self._run_encoder(['pngquant', '--quality', '65-95', '--speed', speed, '--strip', '-'],
+                                       image_data)
+        except Exception as e:
+            self._emit('message', f"  ⚠️  pngquant压缩失败: {e}", level='warning')
+            return None
+        original_size = len(image_data)
+        if result.returncode != 0 or not result.stdout or len(result.stdout) >= original_size:
+            return None
+        saved = original_size - len(result.stdout)
+        self._emit('message', f"  ✓ [pngquant] {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)", level='success')
+        return result.stdout, filename, True
+    
+    def _encode_jpegtran(self, image_data, filename, target_size=None, effort=None):
+        """
+        jpegtran编码器：在DCT系数层面无损优化JPEG，不改变任何像素
+
+        做Huffman表优化、转为渐进式、去掉元数据。无损档位总是使用；
+        其他档位只在不需要缩小尺寸、且原图质量已经不高于目标质量时使用，
+        这时重新编码只会损失画质，无损优化就是最好的结果。
+        """
+        img = Image.open(io.BytesIO(image_data))  # 只读取文件头，不解码
+        if not self.jpeg_lossless:
+            if self._target_dimensions(img.width, img.height, target_size) is not None:
+                return None
+            source_quality = self._estimate_jpeg_quality(img)
+            if source_quality is None or source_quality > self.jpeg_quality:
+                return None
+
+        # 有方向信息或ICC色彩配置时保留元数据，否则去掉会改变显示效果
+        orientation = img.getexif().get(0x0112, 1)
+        copy_mode = 'all' if orientation != 1 or img.info.get('icc_profile') else 'none'
+        try:
+            result = self._run_encoder(['jpegtran', '-copy', copy_mode, '-optimize', '-progressive'],
+                                       image_data)
+        except Exception as e:
+            self._emit('message', f"  ⚠️  jpegtran优化失败: {e}", level='warning')
+            return None
+        if result.returncode != 0 or not result.stdout:
+            return None
+
+        original_size = len(image_data)
+        if len(result.stdout) < original_size:
+            saved = original_size - len(result.stdout)
+            self._emit('message', f"  ✓ [jpegtran无损] {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)", level='success')
+            return result.stdout, filename, True
+        return image_data, filename, False
+    
+    @staticmethod
+    def _estimate_jpeg_quality(img):
+        """根据亮度量化表估算JPEG的IJG质量值，无法估算时返回None"""
+        tables = getattr(img, 'quantization', None)
+        if not tables or 0 not in tables:
+            return None
+        # IJG标准亮度量化表之和，质量50时的基准
+        scale = sum(tables[0]) * 100 / 3688
+        if scale <= 0:
+            return None
+        quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+        return max(1, min(100, round(quality)))
+    
+    def _encode_cjpeg(self, image_data, filename, target_size=None, effort=None):
+        """cjpeg(MozJPEG)编码器：Pillow解码并调整尺寸，再交给cjpeg编码"""
+        img = Image.open(io.BytesIO(image_data))
+        # CMYK等模式转换会改变颜色，交给Pillow原样处理
+        if img.mode not in ('RGB', 'L'):
+            return None
+        img = self._resize_to_target(img, target_size)
+
+        quality = self._jpeg_quality_for(img, filename)
+        pixels = io.BytesIO()
+        img.save(pixels, format='PPM')
+        try:
+            result = self._run_encoder(['cjpeg', '-quality', str(quality), '-optimize', '-progressive'],
+                                       pixels.getvalue())
+        except Exception as e:
+            self._emit('message', f"  ⚠️  cjpeg压缩失败: {e}", level='warning')
+            return None
+        if result.returncode != 0 or not result.stdout:
+            return None
+
+        original_size = len(image_data)
+        if len(result.stdout) < original_size:
+            saved = original_size - len(result.stdout)
+            self._emit('message', f"  ✓ [cjpeg] {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)", level='success')
+            return result.stdout, filename, True
+        return image_data, filename, False
+    
+    def _jpeg_quality_for(self, img, filename):
+        """
+        这张图片编码为JPEG时使用的质量
+
+        设置了ssim_threshold时，在[MIN_SSIM_QUALITY, jpeg_quality]之间二分查找
+        SSIM不低于阈值的最低质量，最多SSIM_SEARCH_STEPS步，区间足够小时提前结束。
+        SSIM在缩小到SSIM_MAX_PIXELS以内的亮度通道上计算；没有NumPy时使用档位的固定质量。
+        """
+        if not self.ssim_threshold or np is None:
+            return self.jpeg_quality
+
+        sample = img if img.mode in ('RGB', 'L') else img.convert('RGB')
+        factor = math.ceil(math.sqrt(sample.width * sample.height / self.SSIM_MAX_PIXELS))
+        if factor > 1:
+            sample = sample.reduce(factor)
+        reference = np.asarray(sample.convert('L'))
+
+        def score(quality):
+            output = io.BytesIO()
+            sample.save(output, format='JPEG', quality=quality)
+            decoded = Image.open(io.BytesIO(output.getvalue())).convert('L')
+            return _ssim(reference, np.asarray(decoded))
+
+        low, high = min(self.MIN_SSIM_QUALITY, self.jpeg_quality), self.jpeg_quality
+        steps = 0
+        while high - low > 2 and steps < self.SSIM_SEARCH_STEPS:
+            middle = (low + high) // 2
+            if score(middle) >= self.ssim_threshold:
+                high = middle
+            else:
+                low = middle + 1
+            steps += 1
+        if high < self.jpeg_quality:
+            self._emit('message', f"  🔍 {filename}: 按SSIM≥{self.ssim_threshold}选择JPEG质量 {high} (档位 {self.jpeg_quality})")
+        return high
+
+    def _memory_cost(self, image_file, data_size, target_size=None):
+        """
+        只读取图片头，估算压缩这张图片需要的内存(字节)
+
+        解码后的像素按每像素4字节，乘以DECODE_OVERHEAD，再加上压缩数据本身。
+        需要缩小的JPEG按draft模式缩放解码后的尺寸计算。无法识别的图片只计压缩数据。
+
+        Args:
+            image_file: 图片数据的文件对象
+            data_size: 压缩数据的大小
+            target_size: 显示所需的(宽, 高)
+        """
+        try:
+            img = Image.open(image_file)
+            width, height = img.size
+        except Exception:
+            return data_size
+        if img.format == 'JPEG':
+            new_size = self._target_dimensions(width, height, target_size)
+            if new_size is not None:
+                scale = 1
+                while (scale < 8 and width // (scale * 2) >= new_size[0]
+                       and height // (scale * 2) >= new_size[1]):
+                    scale *= 2
+                width, height = -(-width // scale), -(-height // scale)
+        return data_size + width * height * 4 * self.DECODE_OVERHEAD
+
+    def _exceeds_memory_limit(self, image_data, target_size=None):
+        """压缩这张图片估计需要的内存是否超过memory_limit"""
+        return bool(self.memory_limit) and \
+            self._memory_cost(io.BytesIO(image_data), len(image_data), target_size) > self.memory_limit
+
+    def _target_dimensions(self, width, height, target_size=None):
+        """
+        计算缩小后的尺寸，不需要缩小时返回None
+
+        max_dimension限制最长边；target_size是显示所需的(宽, 高)，
+        按较大的缩放比例缩小，保证两个方向都不低于显示所需的像素。
+        """
+        ratio = 1.0
+        if self.max_dimension:
+            ratio = min(ratio, self.max_dimension / width, self.max_dimension / height)
+        if target_size:
+            ratio = min(ratio, max(target_size[0] / width, target_size[1] / height))
+        if ratio < 1:
+            return max(1, int(width * ratio)), max(1, int(height * ratio))
+        return None
+    
+    def _resize_to_target(self, img, target_size=None):
+        """
+        按max_dimension和显示尺寸等比缩小图片
+
+        JPEG在解码前先请求解码器按1/2、1/4、1/8缩放解码(draft模式)，
+        得到不小于目标尺寸的最小图像，再用LANCZOS缩放到目标尺寸，
+        大幅减少解码时间和内存占用。设置了内存上限时总是使用draft模式。
+        """
+        new_size = self._target_dimensions(img.width, img.height, target_size)
+        if new_size is not None:
+            with self._trace('resize', 'pillow', pixels=img.width * img.height):
+                if (self.fast_resize or self.memory_limit) and img.format == 'JPEG':
+                    img.draft(img.mode, new_size)
+                img = img.resize(new_size, Image.Resampling.LANCZOS)
+        return img
+    
     def _compress_png_with_pillow(self, image_data, filename):
-        """使用Pillow压缩PNG，保留透明度"""
+        """使用Pillow压缩PNG，保留透明度时不转为JPG"""
         try:
             img = Image.open(io.BytesIO(image_data))
             original_size = len(image_data)
+            original_mode = img.mode
+            png_info = dict(img.info)
             
-            # 如果需要保留透明度
-            if self.preserve_transparency and img.mode in ('RGBA', 'LA', 'P'):
+            # 如果需要保留透明度，所有PNG（包括不透明的RGB/L）都保持PNG格式
+            if self.preserve_transparency:
+                # tRNS色键表示的透明色先转为alpha通道，缩放后色键不再准确
+                if img.mode in ('RGB', 'L') and 'transparency' in img.info:
+                    img = img.convert('RGBA' if img.mode == 'RGB' else 'LA')
+                
                 # 调整尺寸（如果需要）
-                if self.max_dimension:
-                    ratio = min(self.max_dimension / img.width, self.max_dimension / img.height)
-                    if ratio < 1:
-                        new_size = (int(img.width * ratio), int(img.height * ratio))
-                        img = img.resize(new_size, Image.Resampling.LANCZOS)
+                img = self._resize_to_target(img)
                 
                 # aggressive模式：降低颜色数量以获得更好的压缩
                 if self.reduce_colors and img.mode == 'RGBA':
@@ -203,17 +1361,31 @@ class ModernPPTCompressor:
                     rgb_img = rgb_img.convert('RGB')
                     # 重新合并alpha通道
                     img = Image.merge('RGBA', (*rgb_img.split(), alpha))
-                    print(f"  🎨 降低颜色数量到256色")
+                    img.info.update((key, png_info[key]) for key in self.PNG_METADATA_KEYS if key in png_info)
+                    self._emit('message', f"  🎨 降低颜色数量到256色")
                 
-                # 保存为PNG，完全保留透明度
+                # 无损降低色彩模式，像素值不变
+                img = self._reduce_png_mode(img)
+                
+                # 保存为PNG，完全保留透明度；ICC配置和tRNS由Pillow从info写入，DPI和gamma需要单独指定
+                save_args = {}
+                if 'dpi' in img.info:
+                    save_args['dpi'] = img.info['dpi']
+                if 'gamma' in img.info:
+                    pnginfo = PngImagePlugin.PngInfo()
+                    pnginfo.add(b'gAMA', struct.pack('>I', round(img.info['gamma'] * 100000)))
+                    save_args['pnginfo'] = pnginfo
                 output = io.BytesIO()
-                img.save(output, format='PNG', optimize=True, compress_level=9)
+                img.save(output, format='PNG', optimize=True, compress_level=9, **save_args)
                 compressed_data = output.getvalue()
                 
                 if len(compressed_data) < original_size:
                     saved = original_size - len(compressed_data)
-                    tag = "[PNG激进压缩]" if self.reduce_colors else "[PNG保留透明]"
-                    print(f"  ✓ {tag} {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)")
+                    if self.reduce_colors:
+                        tag = "[PNG激进压缩]"
+                    else:
+                        tag = "[PNG保留透明]" if original_mode in ('RGBA', 'LA', 'P') else "[PNG无损]"
+                    self._emit('message', f"  ✓ {tag} {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)", level='success')
                     return compressed_data, filename, True
                 else:
                     return image_data, filename, False
@@ -232,59 +1404,131 @@ class ModernPPTCompressor:
                     img = img.convert('RGB')
                 
                 # 调整尺寸
-                if self.max_dimension:
-                    ratio = min(self.max_dimension / img.width, self.max_dimension / img.height)
-                    if ratio < 1:
-                        new_size = (int(img.width * ratio), int(img.height * ratio))
-                        img = img.resize(new_size, Image.Resampling.LANCZOS)
+                img = self._resize_to_target(img)
                 
                 # 转换为JPEG
                 output = io.BytesIO()
-                img.save(output, format='JPEG', quality=self.jpeg_quality, optimize=True)
+                img.save(output, format='JPEG', quality=self._jpeg_quality_for(img, filename), optimize=True)
                 compressed_data = output.getvalue()
                 new_filename = str(Path(filename).with_suffix('.jpg'))
                 
                 if len(compressed_data) < original_size:
                     saved = original_size - len(compressed_data)
-                    print(f"  ✓ [PNG→JPG] {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)")
+                    self._emit('message', f"  ✓ [PNG→JPG] {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)", level='success')
                     return compressed_data, new_filename, True
                 else:
                     return image_data, filename, False
                     
         except Exception as e:
-            print(f"  ⚠️  PNG压缩失败: {e}")
+            self._emit('message', f"  ⚠️  PNG压缩失败: {e}", level='warning')
             return image_data, filename, False
     
-    def _compress_jpeg(self, image_data, filename):
+    # 抽样检查时每隔多少个像素取一个
+    MODE_SAMPLE_STEP = 61
+    # 降低色彩模式后需要保留的PNG元数据
+    PNG_METADATA_KEYS = ('icc_profile', 'gamma', 'dpi')
+    
+    def _reduce_png_mode(self, img):
+        """
+        无损降低PNG的色彩模式，像素值完全不变
+
+        - 全部不透明的RGBA/LA去掉alpha通道
+        - R=G=B的图片转为灰度
+        - 不超过256种颜色时转为精确调色板(P)，透明度写入tRNS
+        使用NumPy批量分析像素；未安装NumPy时只做去掉不透明alpha这一步。
+        ICC配置、gamma和DPI复制到结果上；带tRNS色键的RGB/L图片应先转为RGBA/LA，
+        否则保持原样。
+        """
+        if img.mode not in ('RGBA', 'LA', 'RGB', 'L') or 'transparency' in img.info:
+            return img
+        original_mode = img.mode
+        metadata = {key: img.info[key] for key in self.PNG_METADATA_KEYS if key in img.info}
+
+        if np is None:
+            if img.mode in ('RGBA', 'LA') and img.getchannel('A').getextrema()[0] == 255:
+                img = img.convert('RGB' if img.mode == 'RGBA' else 'L')
+        else:
+            img = self._reduce_png_mode_numpy(img)
+        img.info.update(metadata)
+
+        if img.mode != original_mode:
+            self._emit('message', f"  🎨 无损降低色彩模式: {original_mode} → {img.mode}")
+        return img
+    
+    def _reduce_png_mode_numpy(self, img):
+        """_reduce_png_mode的NumPy实现"""
+        pixels = np.asarray(img)
+        if pixels.ndim == 2:
+            pixels = pixels[:, :, None]
+        has_alpha = img.mode in ('RGBA', 'LA')
+
+        # 全部不透明时去掉alpha
+        if has_alpha and pixels[:, :, -1].min() == 255:
+            pixels = pixels[:, :, :-1]
+            has_alpha = False
+        color = pixels[:, :, :-1] if has_alpha else pixels
+
+        # 三个通道完全相同时是灰度图
+        grayscale = color.shape[2] == 1 or (
+            np.array_equal(color[:, :, 0], color[:, :, 1])
+            and np.array_equal(color[:, :, 1], color[:, :, 2]))
+        if grayscale:
+            color = color[:, :, :1]
+        pixels = np.concatenate([color, pixels[:, :, -1:]], axis=2) if has_alpha else color
+
+        # 每个像素打包成一个整数，用于统计颜色数
+        channels = pixels.shape[2]
+        packed = np.zeros(pixels.shape[:2], dtype=np.uint32)
+        for channel in range(channels):
+            packed = (packed << 8) | pixels[:, :, channel]
+        palette_colors = None
+        # 先抽样，抽样中已经超过256色时不用再统计全图
+        if len(np.unique(packed.ravel()[::self.MODE_SAMPLE_STEP])) <= 256:
+            colors, indices = np.unique(packed, return_inverse=True)
+            if len(colors) <= 256:
+                palette_colors = colors
+
+        # 灰度不透明图超过16色时8位灰度和调色板一样大，不需要调色板
+        if palette_colors is not None and (has_alpha or not grayscale or len(palette_colors) <= 16):
+            entries = ((palette_colors[:, None] >> (8 * np.arange(channels - 1, -1, -1))) & 0xFF).astype(np.uint8)
+            rgb = entries[:, :1].repeat(3, axis=1) if grayscale else entries[:, :3]
+            result = Image.fromarray(indices.reshape(packed.shape).astype(np.uint8), 'P')
+            result.putpalette(rgb.ravel().tolist())
+            if has_alpha:
+                result.info['transparency'] = entries[:, -1].tobytes()
+            return result
+
+        mode = ('LA' if has_alpha else 'L') if grayscale else ('RGBA' if has_alpha else 'RGB')
+        if mode == img.mode:
+            return img
+        return Image.fromarray(np.ascontiguousarray(pixels if pixels.shape[2] > 1 else pixels[:, :, 0]), mode)
+    
+    def _compress_jpeg(self, image_data, filename, target_size=None):
         """压缩JPEG"""
         try:
             img = Image.open(io.BytesIO(image_data))
             original_size = len(image_data)
             
             # 调整尺寸
-            if self.max_dimension:
-                ratio = min(self.max_dimension / img.width, self.max_dimension / img.height)
-                if ratio < 1:
-                    new_size = (int(img.width * ratio), int(img.height * ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
+            img = self._resize_to_target(img, target_size)
             
             # 压缩JPEG
             output = io.BytesIO()
-            img.save(output, format='JPEG', quality=self.jpeg_quality, optimize=True)
+            img.save(output, format='JPEG', quality=self._jpeg_quality_for(img, filename), optimize=True)
             compressed_data = output.getvalue()
             
             if len(compressed_data) < original_size:
                 saved = original_size - len(compressed_data)
-                print(f"  ✓ [JPEG] {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)")
+                self._emit('message', f"  ✓ [JPEG] {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)", level='success')
                 return compressed_data, filename, True
             else:
                 return image_data, filename, False
                 
         except Exception as e:
-            print(f"  ⚠️  JPEG压缩失败: {e}")
+            self._emit('message', f"  ⚠️  JPEG压缩失败: {e}", level='warning')
             return image_data, filename, False
     
-    def _compress_other(self, image_data, filename):
+    def _compress_other(self, image_data, filename, target_size=None):
         """压缩其他格式"""
         try:
             img = Image.open(io.BytesIO(image_data))
@@ -293,20 +1537,16 @@ class ModernPPTCompressor:
             if img.mode not in ('RGB', 'L'):
                 img = img.convert('RGB')
             
-            if self.max_dimension:
-                ratio = min(self.max_dimension / img.width, self.max_dimension / img.height)
-                if ratio < 1:
-                    new_size = (int(img.width * ratio), int(img.height * ratio))
-                    img = img.resize(new_size, Image.Resampling.LANCZOS)
+            img = self._resize_to_target(img, target_size)
             
             output = io.BytesIO()
-            img.save(output, format='JPEG', quality=self.jpeg_quality, optimize=True)
+            img.save(output, format='JPEG', quality=self._jpeg_quality_for(img, filename), optimize=True)
             compressed_data = output.getvalue()
             new_filename = str(Path(filename).with_suffix('.jpg'))
             
             if len(compressed_data) < original_size:
                 saved = original_size - len(compressed_data)
-                print(f"  ✓ {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)")
+                self._emit('message', f"  ✓ {filename}: 减小 {self.format_size(saved)} ({(saved/original_size*100):.1f}%)", level='success')
                 return compressed_data, new_filename, True
             else:
                 return image_data, filename, False
@@ -314,8 +1554,19 @@ class ModernPPTCompressor:
         except Exception as e:
             return image_data, filename, False
     
-    def compress_ppt(self, input_file, output_file=None, progress_callback=None):
-        """压缩PPT文件，支持进度回调"""
+    def compress_ppt(self, input_file, output_file=None, progress_callback=None, tracer=None):
+        """
+        压缩PPT文件，支持进度回调
+
+        Args:
+            input_file: 输入文件路径
+            output_file: 输出文件路径，None表示在输入文件旁边生成 *_compressed.pptx
+            progress_callback: 进度回调 callback(百分比, 说明)
+            tracer: Tracer，记录各阶段和每张图片的耗时，None表示不记录
+
+        Returns:
+            CompressionResult
+        """
         input_path = Path(input_file)
 
         if not input_path.exists():
@@ -329,98 +1580,278 @@ class ModernPPTCompressor:
         else:
             output_path = Path(output_file)
 
-        print(f"\n📊 开始压缩: {input_path.name}")
-        print(f"原始大小: {self.format_size(input_path.stat().st_size)}")
+        start_time = time.perf_counter()
+        self._emit('message', f"\n📊 开始压缩: {input_path.name}")
+        self._emit('message', f"原始大小: {self.format_size(input_path.stat().st_size)}")
         preset_desc = self.PRESETS[self.preset_name]['desc']
-        print(f"压缩档位: {self.preset_name.upper()} - {preset_desc}")
-        if self.use_oxipng and self.has_oxipng:
-            print(f"🚀 使用oxipng进行PNG无损压缩")
+        self._emit('message', f"压缩档位: {self.preset_name.upper()} - {preset_desc}")
+        for label, names in (('PNG', self.png_backends), ('JPEG', self.jpeg_backends)):
+            available = [name for name in names if self.backend_versions.get(name) is not None]
+            if not available:
+                self._emit('message', f"⚠️  {label}没有可用的编码器，将保持原样", level='warning')
+            elif available != ['pillow']:
+                self._emit('message', f"🚀 {label}编码器: {' → '.join(available)}")
+
+        # 时间预算从开始压缩时计时
+        budget = None
+        if self.time_budget:
+            budget = TimeBudget(self.time_budget)
+            self._emit('message', f"⏱️  时间预算: {self.time_budget:g}秒")
 
-        # 创建临时目录
-        temp_dir = input_path.parent / f"temp_{input_path.stem}"
-        if temp_dir.exists():
-            shutil.rmtree(temp_dir)
-        temp_dir.mkdir()
+        def progress(percent, message):
+            self._emit('progress', message, percent=percent)
+            if progress_callback:
+                progress_callback(percent, message)
 
+        # 先写入同目录下的临时文件，完成后再替换为输出文件，中途失败或中断不会留下不完整的输出
+        temp_path = None
+        self.tracer = tracer
         try:
             # 进度回调
-            if progress_callback:
-                progress_callback(5, '解压 PPT 文件...')
+            progress(5, '读取 PPT 文件...')
 
-            print("📦 解压文件中...")
-            with zipfile.ZipFile(input_path, 'r') as zip_ref:
-                zip_ref.extractall(temp_dir)
+            # 直接从输入压缩包读取成员，在内存中压缩后写入输出压缩包，不解压到磁盘
+            self._emit('message', "📦 读取压缩包目录...")
+            with zipfile.ZipFile(input_path, 'r') as zip_in, \
+                    self._trace('compress_ppt', 'total', input=input_path.name,
+                                preset=self.preset_name, bytes_in=input_path.stat().st_size) as total_span:
+                members = zip_in.infolist()
 
-            if progress_callback:
-                progress_callback(15, '扫描图片文件...')
-
-            # 先统计图片总数
-            image_files = []
-            for root, dirs, files in os.walk(temp_dir):
-                for file in files:
-                    file_path = Path(root) / file
-                    if self.is_image_file(file):
-                        image_files.append((file_path, file))
-
-            total_images = len(image_files)
-            print(f"🖼️  发现 {total_images} 个图片文件")
-
-            image_count = 0
-            total_saved = 0
-            filename_changes = {}
-
-            print("🖼️  压缩图片中...")
-            for idx, (file_path, file) in enumerate(image_files):
-                with open(file_path, 'rb') as f:
-                    original_data = f.read()
-
-                original_size = len(original_data)
-
-                # 压缩图片
-                compressed_data, new_filename, success = self.compress_image(
-                    original_data, file, str(file_path)
-                )
-
-                if success:
-                    # 如果文件名改变了
-                    if new_filename != file:
-                        new_file_path = file_path.parent / new_filename
-                        filename_changes[str(file_path)] = str(new_file_path)
-                        file_path.unlink()
-                        file_path = new_file_path
-
-                    # 保存压缩后的图片
-                    with open(file_path, 'wb') as f:
-                        f.write(compressed_data)
+                # 删除没有被引用的部件，之后的步骤都不再处理它们
+                updated_members = {}
+                if self.prune_orphans or self.prune_layouts:
+                    with self._trace('prune'):
+                        pruned_members, updated_members = self._prune_parts(zip_in, members)
+                    if pruned_members:
+                        self._emit('message', f"🧹 删除 {len(pruned_members)} 个没有被引用的部件")
+                        members = [info for info in members if info.filename not in pruned_members]
 
-                    saved = original_size - len(compressed_data)
-                    image_count += 1
-                    total_saved += saved
+                progress(15, '扫描图片文件...')
 
-                # 更新进度 (15% -> 85%)
-                if progress_callback and total_images > 0:
-                    progress = 15 + int((idx + 1) / total_images * 70)
-                    progress_callback(progress, f'压缩图片 {idx + 1}/{total_images}...')
+                # 先统计图片总数
+                image_members = [info for info in members
+                                 if not info.is_dir() and self.is_image_file(info.filename)]
 
-            # 更新XML引用
-            if filename_changes:
-                if progress_callback:
-                    progress_callback(87, '更新文件引用...')
-                self._update_xml_references(temp_dir, filename_changes)
+                total_images = len(image_members)
+                self._emit('message', f"🖼️  发现 {total_images} 个图片文件")
 
-            if progress_callback:
-                progress_callback(90, '重新打包文件...')
+                # 按内容分组，相同的图片只压缩一次
+                with self._trace('group_duplicates', count=total_images):
+                    image_groups = self._group_duplicate_images(zip_in, image_members)
+                groups_by_name = {group[0].filename: group for group in image_groups}
+                unique_images = len(image_groups)
+                if unique_images < total_images:
+                    self._emit('message', f"🔁 发现 {total_images - unique_images} 个重复图片，相同内容只压缩一次")
 
-            print("📦 重新打包文件...")
-            with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
-                for root, dirs, files in os.walk(temp_dir):
-                    for file in files:
-                        file_path = Path(root) / file
-                        arcname = file_path.relative_to(temp_dir)
-                        zip_ref.write(file_path, arcname)
+                pictures = {}
+                if self.target_dpi or self.apply_crops:
+                    with self._trace('find_pictures'):
+                        pictures = self._find_picture_references(zip_in, members)
 
-            if progress_callback:
-                progress_callback(98, '完成处理...')
+                # 先裁掉不可见的部分，之后的缩小和压缩都基于裁剪后的图片
+                cropped_data = {}
+                if self.apply_crops:
+                    with self._trace('crop'):
+                        cropped_data = self._crop_images(zip_in, image_groups, pictures)
+                    if cropped_data:
+                        self._emit('message', f"✂️  按裁剪区域裁掉 {len(cropped_data)} 个图片的不可见部分")
+
+                # 按幻灯片中的显示尺寸限制分辨率
+                target_sizes = {}
+                if self.target_dpi:
+                    target_sizes = self._display_target_sizes(image_groups, pictures, cropped_data)
+                    if target_sizes:
+                        self._emit('message', f"📐 按显示尺寸({self.target_dpi} DPI)限制 {len(target_sizes)} 个图片的分辨率")
+
+                image_count = 0
+                total_saved = 0
+                compressed_members = {}
+                filename_changes = {}
+                dropped_members = set()
+
+                self._emit('message', "🖼️  压缩图片中...")
+                workers = min(self.workers, unique_images)
+                if workers > 1:
+                    self._emit('message', f"⚡ 并行压缩: {workers} 个进程")
+                with self._trace('compress_images', count=unique_images, workers=workers):
+                    image_results = {}
+                    # 每张图片实际使用的编码器，用于返回结果
+                    image_encoders = {}
+                    for done, (info, _, result, encoder) in enumerate(
+                            self._compress_images(zip_in, [group[0] for group in image_groups],
+                                                  workers, target_sizes, cropped_data, budget), 1):
+                        image_results[info.filename] = self._settle_cropped_result(info, result, cropped_data)
+                        image_encoders[info.filename] = encoder
+
+                        # 更新进度 (15% -> 85%)，按完成数量计算，保证单调递增
+                        if unique_images > 0:
+                            progress(15 + int(done / unique_images * 70), f'压缩图片 {done}/{unique_images}...')
+
+                # 目标大小模式：超出目标时逐级降低质量和分辨率重新压缩
+                if self.target_file_size:
+                    progress(85, '调整压缩参数以满足目标大小...')
+                    with self._trace('fit_target_size'):
+                        image_results, image_encoders = self._fit_target_size(
+                            zip_in, members, image_groups, image_results, image_encoders,
+                            target_sizes, cropped_data, workers, budget)
+
+                for group in image_groups:
+                    info = group[0]
+                    compressed_data, new_filename, success = image_results[info.filename]
+                    if not success:
+                        # 没有使用裁剪后的图片，srcRect保持原样
+                        cropped_data.pop(info.filename, None)
+
+                    canonical_name = None
+                    for member in groups_by_name[info.filename]:
+                        member_name = member.filename
+                        if success:
+                            # 如果扩展名改变了(例如BMP→JPG)，每个成员保留自己的文件名，只换扩展名
+                            stem, ext = posixpath.splitext(member_name)
+                            new_ext = posixpath.splitext(new_filename)[1]
+                            if new_ext != ext:
+                                new_member_name = stem + new_ext
+                                filename_changes[member_name] = new_member_name
+                                member_name = new_member_name
+
+                            compressed_members[member.filename] = (member_name, compressed_data)
+
+                            saved = member.file_size - len(compressed_data)
+                            image_count += 1
+                            total_saved += saved
+
+                        # 合并重复图片：只保留第一个成员，其余引用改指向它
+                        if self.merge_duplicates:
+                            if canonical_name is None:
+                                canonical_name = member_name
+                            else:
+                                filename_changes[member.filename] = canonical_name
+                                dropped_members.add(member.filename)
+
+                if dropped_members:
+                    self._emit('message', f"🔁 合并 {len(dropped_members)} 个重复图片成员")
+
+                # 更新XML引用
+                if filename_changes:
+                    progress(87, '更新文件引用...')
+                    with self._trace('update_references', count=len(filename_changes)):
+                        updated_members.update(self._update_xml_references(
+                            zip_in, members, filename_changes, updated_members))
+                        content_types = self._update_content_types(zip_in, filename_changes, updated_members)
+                        if content_types is not None:
+                            updated_members['[Content_Types].xml'] = content_types
+
+                # 裁剪过的图片，把引用它们的srcRect清空
+                if cropped_data:
+                    cleared_rids = {}
+                    for group in image_groups:
+                        if group[0].filename in cropped_data:
+                            for info in group:
+                                for ref in pictures[info.filename]:
+                                    cleared_rids.setdefault(ref.part, set()).add(ref.rid)
+                    with self._trace('clear_src_rects', count=len(cleared_rids)):
+                        for part, rids in cleared_rids.items():
+                            updated_members[part] = _clear_src_rects(
+                                updated_members.get(part) or zip_in.read(part), rids)
+
+                if self.cache is not None:
+                    self.cache.evict()
+
+                progress(90, '重新打包文件...')
+
+                self._emit('message', "📦 重新打包文件...")
+                fd, temp_name = tempfile.mkstemp(dir=output_path.parent, prefix=f'.{output_path.name}.',
+                                                 suffix='.tmp')
+                os.close(fd)
+                temp_path = Path(temp_name)
+                passthrough_count = 0
+                stored_count = 0
+                stored_bytes = 0
+                deflated_bytes = 0
+                deflate_cpu_time = 0.0
+                # 需要写入的成员按原顺序排好，deflate在线程池中并行进行(zlib压缩时释放GIL)，
+                # 写入仍按顺序逐个进行
+                entries = []
+                for info in members:
+                    if info.filename in dropped_members:
+                        continue
+                    if info.filename in compressed_members:
+                        member_name, data = compressed_members[info.filename]
+                    elif info.filename in updated_members:
+                        member_name, data = info.filename, updated_members[info.filename]
+                    else:
+                        # 内容未改变的成员：直接复制原始压缩数据，不解压也不重新deflate
+                        entries.append((info, None, None))
+                        continue
+                    out_info = zipfile.ZipInfo(member_name, date_time=info.date_time)
+                    out_info.external_attr = info.external_attr
+                    entries.append((info, out_info, data))
+
+                with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zip_out, \
+                        ThreadPoolExecutor(max_workers=self.workers) as deflate_pool, \
+                        self._trace('repack', count=len(entries)) as repack_span:
+                    # 先把需要deflate的成员全部提交，写入时再按顺序取结果
+                    deflate_jobs = {}
+                    if self.workers > 1:
+                        for index, (_, out_info, data) in enumerate(entries):
+                            if (out_info is not None and len(data) < zipfile.ZIP64_LIMIT
+                                    and self._member_compress_type(out_info.filename) == zipfile.ZIP_DEFLATED):
+                                deflate_jobs[index] = deflate_pool.submit(
+                                    _deflate_member, data, self.compresslevel)
+
+                    for index, (info, out_info, data) in enumerate(entries):
+                        if out_info is None:
+                            if _copy_member_raw(zip_in, info, zip_out):
+                                passthrough_count += 1
+                                continue
+                            data = zip_in.read(info)
+                            out_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+                            out_info.external_attr = info.external_attr
+
+                        if index in deflate_jobs:
+                            raw_data, crc, cpu_time = deflate_jobs.pop(index).result()
+                            out_info.compress_type = zipfile.ZIP_DEFLATED
+                            out_info.CRC = crc
+                            out_info.compress_size = len(raw_data)
+                            out_info.file_size = len(data)
+                            _write_member_raw(zip_out, out_info, raw_data)
+                            deflated_bytes += len(data)
+                            deflate_cpu_time += cpu_time
+                            continue
+
+                        # 按成员选择压缩方式：已压缩的媒体直接存储，XML/rels使用deflate
+                        compress_type = self._member_compress_type(out_info.filename)
+                        cpu_start = time.process_time()
+                        zip_out.writestr(out_info, data, compress_type=compress_type,
+                                         compresslevel=self.compresslevel)
+                        if compress_type == zipfile.ZIP_STORED:
+                            stored_count += 1
+                            stored_bytes += len(data)
+                        else:
+                            deflated_bytes += len(data)
+                            deflate_cpu_time += time.process_time() - cpu_start
+
+                    repack_span.update(passthrough=passthrough_count, stored=stored_count,
+                                       stored_bytes=stored_bytes, deflated_bytes=deflated_bytes,
+                                       deflate_cpu=round(deflate_cpu_time, 4))
+
+                if passthrough_count:
+                    self._emit('message', f"📦 {passthrough_count} 个未改动的成员直接复制原始数据")
+                if stored_count:
+                    message = f"📦 {stored_count} 个已压缩媒体文件直接存储 ({self.format_size(stored_bytes)})"
+                    # 按本次deflate的实际吞吐量估算跳过重复压缩节省的CPU时间
+                    if deflated_bytes and deflate_cpu_time > 0:
+                        saved_cpu = stored_bytes / (deflated_bytes / deflate_cpu_time)
+                        message += f"，预计节省CPU时间 {saved_cpu:.2f}s"
+                    self._emit('message', message)
+
+                # mkstemp创建的文件只有所有者可读写，沿用已有输出文件的权限，否则使用常见的0644
+                os.chmod(temp_path, output_path.stat().st_mode & 0o777 if output_path.exists() else 0o644)
+                os.replace(temp_path, output_path)
+                temp_path = None
+                total_span.update(images=image_count, bytes_out=output_path.stat().st_size)
+
+            progress(98, '完成处理...')
 
             # 显示结果
             output_size = output_path.stat().st_size
@@ -428,43 +1859,965 @@ class ModernPPTCompressor:
             total_reduction = input_size - output_size
             reduction_percentage = (total_reduction / input_size) * 100
 
-            print(f"\n✅ 压缩完成!")
-            print(f"压缩图片数量: {image_count}")
-            print(f"原始大小: {self.format_size(input_size)}")
-            print(f"压缩后大小: {self.format_size(output_size)}")
-            print(f"减小: {self.format_size(total_reduction)} ({reduction_percentage:.1f}%)")
-            print(f"输出文件: {output_path}")
+            self._emit('message', f"\n✅ 压缩完成!", level='success')
+            self._emit('message', f"压缩图片数量: {image_count}")
+            self._emit('message', f"原始大小: {self.format_size(input_size)}")
+            self._emit('message', f"压缩后大小: {self.format_size(output_size)}")
+            self._emit('message', f"减小: {self.format_size(total_reduction)} ({reduction_percentage:.1f}%)")
+            self._emit('message', f"输出文件: {output_path}")
 
+            images = []
+            for group in image_groups:
+                info = group[0]
+                compressed_data, _, success = image_results[info.filename]
+                encoder = image_encoders.get(info.filename) if success else None
+                images.append(ImageResult(info.filename, info.file_size,
+                                          len(compressed_data) if success else info.file_size, encoder))
+            return CompressionResult(input_path, output_path, input_size, output_size, images,
+                                     time.perf_counter() - start_time)
+
+        except BaseException:
+            # 失败时删除临时文件，原有的输出文件保持不变
+            if temp_path is not None and temp_path.exists():
+                temp_path.unlink()
+            raise
         finally:
-            if temp_dir.exists():
-                shutil.rmtree(temp_dir)
+            self.tracer = None
+            self._deadline = None
     
-    def _update_xml_references(self, temp_dir, filename_changes):
-        """更新PPT的XML文件中的图片引用"""
-        import xml.etree.ElementTree as ET
-        
-        for rels_file in temp_dir.rglob("*.rels"):
+    def estimate(self, input_file, sample_size=None, seed=0):
+        """
+        不做完整压缩，快速预估本档位的压缩结果
+
+        只读取压缩包目录和确定显示尺寸所需的XML，按图片类型分层抽样压缩少量图片，
+        每层用比率估计(压缩后大小/原始大小)推算全部图片压缩后的大小，
+        并按抽样误差给出95%置信区间(每层样本很少，用自由度n-1的t分位数)；
+        耗时按抽样图片的实测速度推算。
+
+        Args:
+            input_file: 输入文件路径
+            sample_size: 抽样压缩的图片数量，默认ESTIMATE_SAMPLE_SIZE；每层另有ESTIMATE_MIN_PER_STRATUM张的下限
+            seed: 抽样的随机种子，相同种子在各档位抽到相同的图片
+
+        Returns:
+            dict: preset, input_size, estimated_size, low, high(字节),
+                  estimated_seconds, image_count, sampled_count
+        """
+        input_path = Path(input_file)
+        if not input_path.exists():
+            raise FileNotFoundError(f"文件不存在: {input_file}")
+        sample_size = sample_size or self.ESTIMATE_SAMPLE_SIZE
+        input_size = input_path.stat().st_size
+        rng = random.Random(seed)
+
+        with zipfile.ZipFile(input_path, 'r') as zip_in:
+            members = zip_in.infolist()
+            images = [info for info in members
+                      if not info.is_dir() and self.is_image_file(info.filename)]
+            target_sizes = {}
+            if self.target_dpi:
+                pictures = self._find_picture_references(zip_in, members)
+                target_sizes = self._display_target_sizes([[info] for info in images], pictures, {})
+
+            # 按压缩方式分层：PNG、JPEG、其他格式
+            strata = {}
+            for info in images:
+                ext = Path(info.filename).suffix.lower()
+                key = ext if ext in {'.png', '.jpg', '.jpeg'} else 'other'
+                strata.setdefault('.jpg' if key == '.jpeg' else key, []).append(info)
+
+            # 每层至少抽ESTIMATE_MIN_PER_STRATUM张(不足时全部抽取)，其余名额按各层的原始大小分配
+            total_bytes = sum(info.file_size for info in images) or 1
+            estimated_size = input_size - sum(info.compress_size for info in images)
+            margin_squared = 0.0
+            seconds = 0.0
+            sampled_count = 0
+            for infos in strata.values():
+                stratum_bytes = sum(info.file_size for info in infos)
+                count = max(self.ESTIMATE_MIN_PER_STRATUM, round(sample_size * stratum_bytes / total_bytes))
+                sample = rng.sample(infos, min(count, len(infos)))
+                sampled_count += len(sample)
+
+                original_sizes = []
+                compressed_sizes = []
+                elapsed = 0.0
+                for info in sample:
+                    image_data = zip_in.read(info)
+                    start = time.perf_counter()
+                    # 抽样压缩的逐张事件没有意义，不发送给接收器
+                    sinks, self.sinks = self.sinks, []
+                    try:
+                        compressed_data, _, success = self.compress_image(
+                            image_data, posixpath.basename(info.filename),
+                            target_size=target_sizes.get(info.filename))
+                    finally:
+                        self.sinks = sinks
+                    elapsed += time.perf_counter() - start
+                    original_sizes.append(info.file_size)
+                    compressed_sizes.append(len(compressed_data) if success else info.compress_size)
+
+                ratio = sum(compressed_sizes) / max(1, sum(original_sizes))
+                estimated_size += ratio * stratum_bytes
+                seconds += elapsed / max(1, sum(original_sizes)) * stratum_bytes
+
+                n, population = len(sample), len(infos)
+                if n < population:
+                    if n > 1:
+                        residuals = [y - ratio * x for x, y in zip(original_sizes, compressed_sizes)]
+                        spread = sum(r * r for r in residuals) / (n - 1)
+                        variance = population * population * (1 - n / population) * spread / n
+                        margin_squared += _t_quantile_975(n - 1) ** 2 * variance
+                    else:
+                        # 只有一个样本时无法估计方差，按±50%保守估计
+                        margin_squared += (0.5 * ratio * stratum_bytes) ** 2
+
+        margin = math.sqrt(margin_squared)
+        return {
+            'preset': self.preset_name,
+            'input_size': input_size,
+            'estimated_size': int(estimated_size),
+            'low': int(max(0, estimated_size - margin)),
+            'high': int(min(input_size, estimated_size + margin)),
+            'estimated_seconds': seconds / min(self.workers, max(1, len(images))),
+            'image_count': len(images),
+            'sampled_count': sampled_count,
+        }
+
+    def _group_duplicate_images(self, zip_in, image_members):
+        """
+        按内容把图片成员分组，保持原顺序
+
+        先用中央目录中的CRC和大小预筛选，只有可能重复的成员才读取数据计算sha256，
+        大多数不重复的图片不需要额外读取。
+
+        Returns:
+            [[ZipInfo, ...], ...]，每组内容完全相同
+        """
+        candidates = {}
+        for info in image_members:
+            candidates.setdefault((info.CRC, info.file_size), []).append(info)
+
+        groups = []
+        for same_crc in candidates.values():
+            if len(same_crc) == 1:
+                groups.append(same_crc)
+                continue
+            by_hash = {}
+            for info in same_crc:
+                digest = hashlib.sha256(zip_in.read(info)).digest()
+                by_hash.setdefault(digest, []).append(info)
+            groups.extend(by_hash.values())
+
+        order = {info.filename: index for index, info in enumerate(image_members)}
+        groups.sort(key=lambda group: order[group[0].filename])
+        return groups
+
+    def _settle_cropped_result(self, info, result, cropped_data):
+        """裁剪后的图片即使没能进一步压缩也要使用，除非反而比原图大"""
+        if info.filename not in cropped_data:
+            return result
+        compressed_data, new_filename, success = result
+        if not success:
+            compressed_data, new_filename = cropped_data[info.filename], posixpath.basename(info.filename)
+        if len(compressed_data) < info.file_size:
+            return compressed_data, new_filename, True
+        return None, posixpath.basename(info.filename), False
+
+    def _fit_target_size(self, zip_in, members, image_groups, image_results, image_encoders, target_sizes,
+                         source_data, workers, budget=None):
+        """
+        目标大小模式：预计输出超过target_file_size时，逐级降低JPEG质量和分辨率
+
+        TARGET_SIZE_LEVELS从温和到激进排列，每个级别对所有图片压缩一遍，
+        结果在查找过程中复用。先试最激进的级别确认能达到目标，再按已知级别的
+        预计大小插值猜测下一个级别(整份文件的大小-压缩级别曲线)，
+        找到能满足目标的最温和级别，通常只需要两三遍。
+        某个级别没能压缩的图片(包括时间预算用完跳过的)沿用第一遍的结果；
+        时间预算用完后停止查找，使用已知满足目标的级别。
+
+        Returns:
+            ({代表成员名: compress_image的返回值}, {代表成员名: 使用的编码器})，
+            编码器取自最终选用的级别
+        """
+        target = self.target_file_size
+        estimated = self._estimate_output_size(members, image_groups, image_results)
+        self._emit('message', f"🎯 目标大小: {self.format_size(target)}，当前预计: {self.format_size(estimated)}")
+        if estimated <= target:
+            return image_results, image_encoders
+        if budget is not None and budget.remaining() <= 0:
+            self._emit('message', "⚠️  时间预算已用完，不再调整压缩参数", level='warning')
+            return image_results, image_encoders
+
+        dimensions = {}
+
+        def image_dimensions(info):
+            if info.filename not in dimensions:
+                try:
+                    data = self._read_image(zip_in, info, source_data)
+                    dimensions[info.filename] = Image.open(io.BytesIO(data)).size  # 只读取文件头
+                except Exception:
+                    dimensions[info.filename] = None
+            return dimensions[info.filename]
+
+        level_results = {-1: (image_results, estimated, image_encoders)}
+
+        def evaluate(level):
+            if level in level_results:
+                return level_results[level]
+            quality_offset, scale = self.TARGET_SIZE_LEVELS[level]
+            compressor = self._target_size_compressor(quality_offset)
+            results = dict(image_results)
+            encoders = dict(image_encoders)
+            pending = []
+            level_targets = {}
+            for group in image_groups:
+                info = group[0]
+                # 只降低质量时，PNG等不受JPEG质量影响的图片沿用第一遍的结果
+                new_filename = image_results[info.filename][1]
+                is_jpeg = (Path(new_filename).suffix.lower() in {'.jpg', '.jpeg'}
+                           or Path(info.filename).suffix.lower() in {'.jpg', '.jpeg'})
+                if scale == 1.0 and not is_jpeg:
+                    continue
+                pending.append(info)
+                size = target_sizes.get(info.filename)
+                if scale < 1.0:
+                    size = size or image_dimensions(info)
+                    if size:
+                        size = (max(1, int(size[0] * scale)), max(1, int(size[1] * scale)))
+                if size:
+                    level_targets[info.filename] = size
+
+            self._emit('message', f"🎯 尝试 JPEG质量 {compressor.jpeg_quality}、分辨率 {scale:.0%}，重新压缩 {len(pending)} 个图片")
+            for info, _, result, encoder in compressor._compress_images(
+                    zip_in, pending, min(workers, len(pending) or 1), level_targets, source_data, budget):
+                result = self._settle_cropped_result(info, result, source_data)
+                # 没有压缩成功时原图不会比第一遍的结果小
+                if result[2]:
+                    results[info.filename] = result
+                    encoders[info.filename] = encoder
+            level_estimated = self._estimate_output_size(members, image_groups, results)
+            self._emit('message', f"🎯 预计大小: {self.format_size(level_estimated)}")
+            level_results[level] = (results, level_estimated, encoders)
+            return level_results[level]
+
+        low, high = -1, len(self.TARGET_SIZE_LEVELS) - 1
+        results, high_estimated, encoders = evaluate(high)
+        if high_estimated > target:
+            self._emit('message', "⚠️  最激进的设置也无法达到目标大小，使用能得到的最小结果", level='warning')
+            return results, encoders
+
+        # low总是超出目标，high总是满足目标，在两者之间按预计大小线性插值
+        while high - low > 1:
+            if budget is not None and budget.remaining() <= 0:
+                self._emit('message', "⏱️  时间预算已用完，使用已知满足目标的设置")
+                break
+            low_estimated = level_results[low][1]
+            high_estimated = level_results[high][1]
+            fraction = (low_estimated - target) / max(1, low_estimated - high_estimated)
+            level = min(high - 1, max(low + 1, low + round(fraction * (high - low))))
+            if evaluate(level)[1] <= target:
+                high = level
+            else:
+                low = level
+        results, _, encoders = level_results[high]
+        return results, encoders
+
+    def _target_size_compressor(self, quality_offset):
+        """目标大小模式某个级别使用的压缩器：在当前配置的基础上降低JPEG质量"""
+        compressor = copy.copy(self)
+        compressor.jpeg_quality = max(self.MIN_TARGET_QUALITY, self.jpeg_quality + quality_offset)
+        if self.jpeg_lossless:
+            # 无损档位不会重新编码JPEG，要达到目标大小只能允许有损压缩
+            compressor.jpeg_lossless = False
+            compressor.jpeg_backends = self.jpeg_backends + ['pillow']
+            compressor.backend_versions = dict(self.backend_versions, pillow=probe_backend('pillow'))
+        return compressor
+
+    def _estimate_output_size(self, members, image_groups, image_results):
+        """按各成员的压缩后大小和ZIP文件头开销估算输出文件大小"""
+        def entry_size(info, data_size):
+            # 本地文件头30字节 + 中央目录项46字节，各含一份文件名
+            return 76 + 2 * len(info.filename.encode('utf-8')) + data_size
+
+        size = 22  # 中央目录结束记录
+        for info in members:
+            size += entry_size(info, info.compress_size)
+        for group in image_groups:
+            compressed_data, _, success = image_results[group[0].filename]
+            if not success:
+                continue
+            for index, info in enumerate(group):
+                size -= entry_size(info, info.compress_size)
+                if index == 0 or not self.merge_duplicates:
+                    size += entry_size(info, len(compressed_data))
+        return size
+
+    def _compress_images(self, zip_in, image_members, workers, target_sizes=None, source_data=None,
+                         budget=None):
+        """
+        压缩压缩包中的图片成员，workers > 1 时使用进程池并行压缩
+
+        需要oxipng处理的PNG足够多时，先用一次oxipng调用批量压缩，
+        没有效果的再交给Pillow。target_sizes是{成员名: 显示所需的(宽, 高)像素}，
+        source_data是{成员名: 代替原数据压缩的图片数据}(例如裁剪后的图片)。
+        有时间预算(TimeBudget)时不做批量压缩，按从大到小的顺序逐张分配压缩力度，
+        大图片预期节省最多，优先使用较高的力度。
+        设置了内存上限时，按图片头估算每张图片需要的内存，超过上限的保持原样，
+        并行压缩时同时处理的图片估计内存之和不超过上限。
+        预算到期时编码器的超时也到期；并行压缩时还没有完成的图片不再等待，保持原样。
+
+        Yields:
+            (ZipInfo, 原始大小, compress_image的返回值, 使用的编码器)，按完成顺序，
+            没有压缩成功时编码器为None
+        """
+        target_sizes = target_sizes or {}
+        source_data = source_data or {}
+        self._deadline = budget.deadline if budget is not None else None
+        memory_costs = {}
+        if self.memory_limit:
+            image_members = list(image_members)
+            for info in list(image_members):
+                cost = self._member_memory_cost(zip_in, info, source_data, target_sizes.get(info.filename))
+                if cost > self.memory_limit:
+                    filename = posixpath.basename(info.filename)
+                    self._emit('message', f"  ⚠️  {filename}: 解码需要的内存超过上限，保持原样", level='warning')
+                    image_members.remove(info)
+                    original_size = len(source_data[info.filename]) if info.filename in source_data else info.file_size
+                    yield info, original_size, (None, filename, False), None
+                else:
+                    memory_costs[info.filename] = cost
+        pending = image_members
+        skip_oxipng = set()
+        if self.oxipng_batch and budget is None:
+            png_members = [info for info in image_members if self._uses_oxipng(info.filename)]
+            if len(png_members) >= self.OXIPNG_BATCH_MIN:
+                threads = workers
+                if self.memory_limit:
+                    # oxipng的每个线程同时处理一张PNG，按最大的一张限制线程数
+                    largest = max(memory_costs[info.filename] for info in png_members)
+                    threads = max(1, min(workers, self.memory_limit // largest))
+                batched = set()
+                for info, original_size, result, encoder in self._compress_png_members_batched(
+                        zip_in, png_members, threads, target_sizes, source_data):
+                    if result is None:
+                        skip_oxipng.add(info.filename)
+                    else:
+                        batched.add(info.filename)
+                        yield info, original_size, result, encoder
+                pending = [info for info in image_members if info.filename not in batched]
+
+        def member_size(info):
+            return len(source_data[info.filename]) if info.filename in source_data else info.file_size
+
+        if budget is not None:
+            pending = sorted(pending, key=member_size, reverse=True)
+        # 还没有压缩完的图片总大小，用于分配压缩力度
+        remaining_bytes = sum(member_size(info) for info in pending)
+
+        def choose_effort(info, filename):
+            effort = budget.choose_effort(remaining_bytes, self.max_effort, workers, member_size(info))
+            if effort is None:
+                self._emit('message', f"  ⏱️  时间预算不足，保持原样: {filename}")
+            elif effort < self.max_effort:
+                self._emit('message', f"  ⏱️  {filename}: 按时间预算降低压缩力度 {self.max_effort} → {effort}")
+            return effort
+
+        if workers <= 1:
+            for info in pending:
+                filename = posixpath.basename(info.filename)
+                effort = None
+                if budget is not None:
+                    effort = choose_effort(info, filename)
+                    if effort is None:
+                        # 预算用完时不再读取图片
+                        remaining_bytes -= member_size(info)
+                        yield info, member_size(info), (None, filename, False), None
+                        continue
+                original_data = self._read_image(zip_in, info, source_data)
+                start = time.monotonic()
+                result = self.compress_image(original_data, filename,
+                                             skip_oxipng=info.filename in skip_oxipng,
+                                             target_size=target_sizes.get(info.filename), effort=effort)
+                if budget is not None:
+                    budget.record(effort, len(original_data), time.monotonic() - start)
+                remaining_bytes -= member_size(info)
+                yield info, len(original_data), result, self._encoder
+            return
+
+        # 事件接收器(例如界面的回调)不一定能序列化，子进程的事件由任务结果带回主进程再发送
+        worker_compressor = copy.copy(self)
+        worker_compressor.sinks = []
+        worker_compressor.tracer = Tracer() if self.tracer is not None else None
+        # 服务器和图形界面在多线程进程中调用这里，fork可能在子进程中继承被其他线程持有的锁而死锁，
+        # 所以总是用spawn启动子进程；运行时注册的编码器随初始化参数一起传给子进程
+        executor = ProcessPoolExecutor(max_workers=workers,
+                                       mp_context=multiprocessing.get_context('spawn'),
+                                       initializer=_init_worker,
+                                       initargs=(worker_compressor, dict(ENCODER_BACKENDS)))
+        expired = False
+        try:
+            # 逐步提交任务：有时间预算时力度要在提交时按最新进度决定，
+            # 同时不必一次把所有图片读入内存；有内存上限时，估计内存超出上限就先等已提交的完成
+            max_in_flight = workers if budget is not None else workers * 2
+            futures = {}
+            in_flight_memory = 0
+            next_index = 0
+            while next_index < len(pending) or futures:
+                while next_index < len(pending) and len(futures) < max_in_flight:
+                    info = pending[next_index]
+                    cost = memory_costs.get(info.filename, 0)
+                    if futures and in_flight_memory + cost > (self.memory_limit or math.inf):
+                        break
+                    next_index += 1
+                    filename = posixpath.basename(info.filename)
+                    effort = None
+                    if budget is not None:
+                        effort = choose_effort(info, filename)
+                        if effort is None:
+                            remaining_bytes -= member_size(info)
+                            yield info, member_size(info), (None, filename, False), None
+                            continue
+                    original_data = self._read_image(zip_in, info, source_data)
+                    future = executor.submit(_compress_image_job, original_data, filename,
+                                             info.filename in skip_oxipng,
+                                             target_sizes.get(info.filename), effort,
+                                             budget.remaining() if budget is not None else None)
+                    futures[future] = (info, len(original_data), effort, cost)
+                    in_flight_memory += cost
+                if not futures:
+                    continue
+
+                timeout = max(0, budget.remaining()) if budget is not None else None
+                done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    # 时间预算已用完，还没有完成的图片保持原样；没有提交的图片由choose_effort跳过
+                    expired = True
+                    for info, original_size, _, _ in futures.values():
+                        filename = posixpath.basename(info.filename)
+                        self._emit('message', f"  ⏱️  时间预算已用完，保持原样: {filename}")
+                        remaining_bytes -= member_size(info)
+                        yield info, original_size, (None, filename, False), None
+                    futures.clear()
+                    in_flight_memory = 0
+                    continue
+                for future in done:
+                    info, original_size, effort, cost = futures.pop(future)
+                    in_flight_memory -= cost
+                    remaining_bytes -= member_size(info)
+                    try:
+                        result, encoder, events, elapsed, spans = future.result()
+                    except Exception as e:
+                        # 子进程崩溃时保留原图
+                        self._emit('message', f"  ⚠️  压缩图片失败 {info.filename}: {str(e)}", level='warning')
+                        yield info, original_size, (None, posixpath.basename(info.filename), False), None
+                        continue
+                    # 子进程的事件按原顺序交给主进程的接收器
+                    for event in events:
+                        for sink in self.sinks:
+                            sink(event)
+                    if spans:
+                        self.tracer.extend(spans)
+                    if budget is not None:
+                        budget.record(effort, original_size, elapsed)
+                    yield info, original_size, result, encoder
+        finally:
+            # 预算到期时不等待还在运行的任务，它们的编码器超时已经限制在预算以内
+            executor.shutdown(wait=not expired, cancel_futures=expired)
+
+    def _member_memory_cost(self, zip_in, info, source_data, target_size=None):
+        """估算压缩一个图片成员需要的内存，只读取图片头，不读取整个成员"""
+        if info.filename in source_data:
+            data = source_data[info.filename]
+            return self._memory_cost(io.BytesIO(data), len(data), target_size)
+        with zip_in.open(info) as image_file:
+            return self._memory_cost(image_file, info.file_size, target_size)
+
+    def _read_image(self, zip_in, info, source_data):
+        """读取要压缩的图片数据，source_data中有替代数据时使用替代数据"""
+        if info.filename in source_data:
+            return source_data[info.filename]
+        with self._trace('unzip', 'io', member=info.filename, bytes_in=info.compress_size) as span:
+            data = zip_in.read(info)
+            span['bytes_out'] = len(data)
+        return data
+
+    def _compress_png_members_batched(self, zip_in, png_members, threads, target_sizes, source_data):
+        """
+        批量oxipng压缩PNG成员，命中缓存的直接返回
+
+        需要缩小的PNG不参与批量压缩，留给普通流程在进程池中缩小后再压缩，
+        避免在父进程中串行缩小并同时持有所有中间数据。
+
+        Yields:
+            (ZipInfo, 原始大小, compress_image的返回值, 使用的编码器)，
+            oxipng没有效果时返回值为None，调用方应改用Pillow；
+            没有参与批量压缩的成员不返回
+        """
+        batch = []
+        for info in png_members:
+            target_size = target_sizes.get(info.filename)
+            if self._png_needs_downscale(zip_in, info, source_data, target_size):
+                continue
+            image_data = self._read_image(zip_in, info, source_data)
+            filename = posixpath.basename(info.filename)
+            self._emit('image_started', filename=filename, original_size=len(image_data))
+            cache_key = None
+            if self.cache is not None:
+                cache_key = self._cache_key(image_data, filename, target_size)
+                cached = self._get_cached(cache_key, image_data, filename)
+                if cached is not None:
+                    self._emit('image_finished', filename=filename, original_size=len(image_data),
+                               compressed_size=len(cached[0]) if cached[2] else len(image_data),
+                               encoder='cache' if cached[2] else None, success=cached[2])
+                    yield info, len(image_data), cached, 'cache' if cached[2] else None
+                    continue
+            batch.append((info, filename, image_data, cache_key))
+
+        if not batch:
+            return
+        self._emit('message', f"🚀 oxipng批量压缩 {len(batch)} 张PNG")
+        self._cut_short = False
+        with self._trace('oxipng_batch', 'encoder', count=len(batch),
+                         bytes_in=sum(len(item[2]) for item in batch)) as span:
+            outputs = self._compress_pngs_with_oxipng_batch(
+                [(filename, image_data) for _, filename, image_data, _ in batch], threads)
+            span['bytes_out'] = sum(len(data) for data in outputs if data)
+
+        for (info, filename, image_data, cache_key), compressed_data in zip(batch, outputs):
+            original_size = len(image_data)
+            if not compressed_data or len(compressed_data) >= original_size:
+                yield info, original_size, None, None
+                continue
+
+            result = (compressed_data, filename, True)
+            self._emit('message', f"  ✓ [oxipng] {filename}: 减小 {self.format_size(original_size - len(compressed_data))} ({((original_size - len(compressed_data))/original_size*100):.1f}%)", level='success')
+            self._emit('image_finished', filename=filename, original_size=original_size,
+                       compressed_size=len(compressed_data), encoder='oxipng', success=True)
+            if cache_key is not None and not self._cut_short:
+                self._put_cached(cache_key, result)
+            yield info, original_size, result, 'oxipng'
+
+    def _png_needs_downscale(self, zip_in, info, source_data, target_size):
+        """
+        只读取PNG文件头，判断是否需要先缩小
+
+        无法识别的图片也返回True，不参与批量压缩，由逐张压缩的流程处理失败
+        """
+        if info.filename in source_data:
+            stream = io.BytesIO(source_data[info.filename])
+        else:
+            stream = zip_in.open(info)
+        try:
+            with stream, Image.open(stream) as img:
+                return self._target_dimensions(img.width, img.height, target_size) is not None
+        except Exception:
+            return True
+
+    def _prune_parts(self, zip_in, members):
+        """
+        删除没有被引用的部件，prune_layouts时还删除没有幻灯片使用的版式和母版
+
+        Returns:
+            (删除的成员名集合, {成员名: 改写后的数据})
+        """
+        updated_members = {}
+        unreachable = self._find_unreachable_parts(zip_in, members, updated_members)
+        if self.prune_layouts:
+            reachable_members = [info for info in members if info.filename not in unreachable]
+            updated_members = self._unlink_unused_layouts(zip_in, reachable_members)
+            if updated_members:
+                unreachable = self._find_unreachable_parts(zip_in, members, updated_members)
+
+        if unreachable and '[Content_Types].xml' in zip_in.NameToInfo:
+            content_types = updated_members.get('[Content_Types].xml') or zip_in.read('[Content_Types].xml')
+            for name in unreachable:
+                # 部件名不区分大小写
+                content_types, _ = _remove_element(content_types, 'Override', 'PartName', '/' + name, re.I)
+            updated_members['[Content_Types].xml'] = content_types
+        return unreachable, updated_members
+
+    def _find_unreachable_parts(self, zip_in, members, updated_members):
+        """
+        从_rels/.rels开始沿关系图遍历，找出没有被任何关系引用到的部件
+
+        updated_members中的数据代替压缩包中对应的成员。
+
+        Returns:
+            不可达的成员名集合(包括它们的.rels)，关系文件无法解析时返回空集合
+        """
+        names = {info.filename for info in members if not info.is_dir()}
+        # OPC部件名不区分大小写
+        names_by_lower = {name.lower(): name for name in names}
+        reachable = {'[Content_Types].xml'}
+        pending = ['']
+
+        while pending:
+            part = pending.pop()
+            rels_name = _part_rels_name(part)
+            if rels_name not in names:
+                continue
+            reachable.add(rels_name)
+            try:
+                rels_root = ET.fromstring(updated_members.get(rels_name) or zip_in.read(rels_name))
+            except Exception as e:
+                self._emit('message', f"  ⚠️  无法解析 {rels_name}，不删除任何部件: {str(e)}", level='warning')
+                return set()
+            for rel in rels_root.iter(f'{{{RELS_NS}}}Relationship'):
+                if rel.get('TargetMode') == 'External' or not rel.get('Target'):
+                    continue
+                target = names_by_lower.get(_resolve_part_name(part, rel.get('Target')).lower())
+                if target is not None and target not in reachable:
+                    reachable.add(target)
+                    pending.append(target)
+
+        if '_rels/.rels' not in reachable:
+            return set()
+        return names - reachable
+
+    def _unlink_unused_layouts(self, zip_in, members):
+        """
+        断开没有幻灯片使用的版式与母版、不再使用的母版与演示文稿之间的关系
+
+        只改写ID列表(p:sldLayoutIdLst、p:sldMasterIdLst)和对应的.rels，
+        部件本身之后由可达性分析删除。至少保留一个在用的母版。
+
+        Returns:
+            {成员名: 改写后的数据}
+        """
+        names = {info.filename for info in members}
+        used_layouts = set()
+        layout_links = []  # (母版, rId, 版式)
+        master_links = []  # (演示文稿, rId, 母版)
+        layout_masters = {}
+
+        for info in members:
+            if not info.filename.endswith('.rels'):
+                continue
+            source_part = _rels_source_part(info.filename)
+            source_dir = posixpath.dirname(source_part)
+            try:
+                rels_root = ET.fromstring(zip_in.read(info))
+            except Exception:
+                return {}
+            for rel in rels_root.iter(f'{{{RELS_NS}}}Relationship'):
+                if rel.get('TargetMode') == 'External' or not rel.get('Target'):
+                    continue
+                target = _resolve_part_name(source_part, rel.get('Target'))
+                if target not in names:
+                    continue
+                target_dir = posixpath.dirname(target)
+                if target_dir == 'ppt/slideLayouts':
+                    if source_dir == 'ppt/slideMasters':
+                        layout_links.append((source_part, rel.get('Id'), target))
+                    else:
+                        used_layouts.add(target)
+                elif target_dir == 'ppt/slideMasters':
+                    if source_dir == 'ppt/slideLayouts':
+                        layout_masters[source_part] = target
+                    else:
+                        master_links.append((source_part, rel.get('Id'), target))
+
+        used_masters = {layout_masters[layout] for layout in used_layouts if layout in layout_masters}
+        if not used_masters:
+            return {}
+
+        updated_members = {}
+
+        def unlink(part, tag, rid):
+            # ID列表中的元素和关系都恰好找到一处才改写
+            rels_name = _part_rels_name(part)
+            xml_data, xml_count = _remove_element(
+                updated_members.get(part) or zip_in.read(part), tag, 'r:id', rid)
+            rels_data, rels_count = _remove_element(
+                updated_members.get(rels_name) or zip_in.read(rels_name), 'Relationship', 'Id', rid)
+            if xml_count != 1 or rels_count != 1:
+                return False
+            updated_members[part] = xml_data
+            updated_members[rels_name] = rels_data
+            return True
+
+        layout_count = sum(1 for master, rid, layout in layout_links
+                           if master in used_masters and layout not in used_layouts
+                           and unlink(master, 'p:sldLayoutId', rid))
+        master_count = sum(1 for presentation, rid, master in master_links
+                           if master not in used_masters and unlink(presentation, 'p:sldMasterId', rid))
+        if layout_count or master_count:
+            self._emit('message', f"🧹 移除 {layout_count} 个未使用的版式和 {master_count} 个未使用的母版")
+        return updated_members
+
+    def _find_picture_references(self, zip_in, members):
+        """
+        从幻灯片、版式、母版等XML中找出每个图片的所有引用
+
+        解析p:pic的a:ext(EMU)和srcRect，通过r:embed和.rels找到对应的图片。
+        只要图片有一处引用不是p:pic(背景、形状填充、图表、主题等)，
+        就无法确定它的显示方式，不返回该图片。
+
+        Returns:
+            {图片成员名: [PictureRef, ...]}
+        """
+        image_names = {info.filename for info in members if self.is_image_file(info.filename)}
+        pictures = {}
+        unconstrained = set()
+
+        for info in members:
+            if not info.filename.endswith('.rels'):
+                continue
+            source_part = _rels_source_part(info.filename)
+            try:
+                rels_root = ET.fromstring(zip_in.read(info))
+            except Exception:
+                continue
+
+            image_rids = {}
+            for rel in rels_root.iter(f'{{{RELS_NS}}}Relationship'):
+                if rel.get('TargetMode') == 'External' or not rel.get('Target'):
+                    continue
+                target = _resolve_part_name(source_part, rel.get('Target'))
+                if target in image_names:
+                    image_rids[rel.get('Id')] = target
+            if not image_rids:
+                continue
+
+            if not DISPLAY_PART_PATTERN.match(source_part):
+                unconstrained.update(image_rids.values())
+                continue
             try:
-                tree = ET.parse(rels_file)
-                root = tree.getroot()
+                root = ET.fromstring(zip_in.read(source_part))
+            except Exception:
+                unconstrained.update(image_rids.values())
+                continue
+
+            refs, handled = _collect_pictures(root, source_part, image_rids)
+            for ref in refs:
+                pictures.setdefault(image_rids[ref.rid], []).append(ref)
+            # 其他任何地方引用了该图片，都不处理
+            for element in root.iter():
+                if element in handled:
+                    continue
+                for name, value in element.attrib.items():
+                    if name.startswith(f'{{{NS["r"]}}}') and value in image_rids:
+                        unconstrained.add(image_rids[value])
+
+        return {name: refs for name, refs in pictures.items() if name not in unconstrained}
+
+    def _display_target_sizes(self, image_groups, pictures, cropped):
+        """
+        按显示尺寸和target_dpi计算每组图片需要的像素尺寸，同组的重复图片取最大的显示尺寸
+
+        没有裁剪过的图片，显示的只是srcRect以内的部分，需要换算成完整图片的尺寸。
+        平铺填充的图片显示尺寸和像素尺寸无关，所在的组不限制尺寸。
+
+        Returns:
+            {代表成员名: (宽, 高)}
+        """
+        target_sizes = {}
+        for group in image_groups:
+            if not all(info.filename in pictures for info in group):
+                continue
+            if not all(ref.stretch for info in group for ref in pictures[info.filename]):
+                continue
+            width = height = 0
+            for info in group:
+                for ref in pictures[info.filename]:
+                    ref_width, ref_height = ref.width, ref.height
+                    if group[0].filename not in cropped:
+                        left, top, right, bottom = ref.crop
+                        ref_width /= 1 - (left + right) / 100000
+                        ref_height /= 1 - (top + bottom) / 100000
+                    width = max(width, ref_width)
+                    height = max(height, ref_height)
+            target_sizes[group[0].filename] = (
+                math.ceil(width * self.target_dpi / EMU_PER_INCH),
+                math.ceil(height * self.target_dpi / EMU_PER_INCH))
+        return target_sizes
+
+    def _crop_images(self, zip_in, image_groups, pictures):
+        """
+        裁掉图片在幻灯片上不可见的部分
+
+        只处理所有引用都是拉伸填充的p:pic、并且srcRect完全相同的图片，
+        裁剪后把这些引用的srcRect清空，显示效果不变。
+
+        Returns:
+            {代表成员名: 裁剪后的图片数据}
+        """
+        candidates = {}
+        for group in image_groups:
+            if not all(info.filename in pictures for info in group):
+                continue
+            refs = [ref for info in group for ref in pictures[info.filename]]
+            crops = {ref.crop for ref in refs}
+            if len(crops) != 1 or not all(ref.stretch for ref in refs):
+                continue
+            crop = crops.pop()
+            # 负值表示向外扩展，不能靠裁剪实现
+            if not any(crop) or min(crop) < 0:
+                continue
+            candidates[group[0].filename] = (group[0], refs, crop)
+
+        # 原始XML中能定位到的srcRect数量必须和引用数量一致，否则改写时会漏掉或改错
+        expected = {}
+        for name, (_, refs, _) in candidates.items():
+            for ref in refs:
+                key = (ref.part, ref.rid)
+                count, _ = expected.get(key, (0, name))
+                expected[key] = (count + 1, name)
+        xml_cache = {}
+        for (part, rid), (count, name) in expected.items():
+            if part not in xml_cache:
+                xml_cache[part] = zip_in.read(part)
+            if len(_src_rect_pattern(rid).findall(xml_cache[part])) != count:
+                candidates.pop(name, None)
+
+        cropped = {}
+        for name, (info, _, crop) in candidates.items():
+            cropped_data = self._crop_image(zip_in.read(info), posixpath.basename(name), crop)
+            if cropped_data is not None:
+                cropped[name] = cropped_data
+        return cropped
+
+    def _crop_image(self, image_data, filename, crop):
+        """
+        按srcRect(l, t, r, b，单位1/100000)裁剪图片，保持原格式
+
+        Returns:
+            裁剪后的图片数据，无法裁剪时返回None
+        """
+        try:
+            if self._exceeds_memory_limit(image_data):
+                return None
+            img = Image.open(io.BytesIO(image_data))
+            if img.format not in ('PNG', 'JPEG') or getattr(img, 'is_animated', False):
+                return None
+            if img.format == 'JPEG':
+                # 重新编码JPEG是有损的，无损档位不裁剪；带旋转信息的照片裁剪方向不确定，也不处理
+                if self.jpeg_lossless or img.getexif().get(0x0112, 1) != 1:
+                    return None
+
+            width, height = img.size
+            left, top, right, bottom = crop
+            # 边缘只裁掉完整的不可见像素
+            box = (math.floor(width * left / 100000), math.floor(height * top / 100000),
+                   width - math.floor(width * right / 100000), height - math.floor(height * bottom / 100000))
+            if box == (0, 0, width, height) or box[2] <= box[0] or box[3] <= box[1]:
+                return None
+
+            cropped = img.crop(box)
+            params = {key: img.info[key] for key in ('icc_profile', 'dpi', 'exif') if key in img.info}
+            output = io.BytesIO()
+            if img.format == 'JPEG':
+                # 沿用原图的量化表和色度采样，尽量减少重新编码的损失
+                cropped.save(output, format='JPEG', qtables=img.quantization,
+                             subsampling=JpegImagePlugin.get_sampling(img), **params)
+            else:
+                if 'transparency' in img.info:
+                    params['transparency'] = img.info['transparency']
+                cropped.save(output, format='PNG', compress_level=1, **params)
+            self._emit('message', f"  ✂️  {filename}: 裁掉不可见区域 {width}x{height} → {cropped.width}x{cropped.height}")
+            return output.getvalue()
+        except Exception as e:
+            self._emit('message', f"  ⚠️  裁剪失败 {filename}: {str(e)}", level='warning')
+            return None
+
+    def _member_compress_type(self, member_name):
+        """根据扩展名选择成员的压缩方式"""
+        if posixpath.splitext(member_name)[1].lower() in self.STORED_EXTENSIONS:
+            return zipfile.ZIP_STORED
+        return zipfile.ZIP_DEFLATED
+
+    def _update_xml_references(self, zip_in, members, filename_changes, updated_members=None):
+        """
+        更新PPT的XML文件中的图片引用
+
+        每个关系的Target解析为完整的部件名后，在filename_changes中按部件名精确查找，
+        原始数据中不包含任何改名文件名的rels直接跳过，不解析。
+        updated_members中已经改写过的rels在改写后的数据上继续更新。
+
+        Returns:
+            {成员名: 更新后的rels数据}，只包含有改动的文件
+        """
+        previous = updated_members or {}
+        updated_members = {}
+        # rels中的Target可能经过URL编码，两种写法都作为快速筛选的关键字
+        basenames = set()
+        for old_name in filename_changes:
+            basename = posixpath.basename(old_name)
+            basenames.update({basename.encode('utf-8'), quote(basename).encode('utf-8')})
+        candidate_pattern = re.compile(b'|'.join(re.escape(name) for name in sorted(basenames)), re.I)
+
+        for info in members:
+            if not info.filename.endswith('.rels'):
+                continue
+            try:
+                data = previous.get(info.filename) or zip_in.read(info)
+                if not candidate_pattern.search(data):
+                    continue
+                source_part = _rels_source_part(info.filename)
+                root = ET.fromstring(data)
                 modified = False
-                
-                for rel in root.findall('.//{http://schemas.openxmlformats.org/package/2006/relationships}Relationship'):
+
+                for rel in root.iter(f'{{{RELS_NS}}}Relationship'):
                     target = rel.get('Target')
-                    if target:
-                        for old_name, new_name in filename_changes.items():
-                            old_basename = Path(old_name).name
-                            new_basename = Path(new_name).name
-                            if old_basename in target:
-                                new_target = target.replace(old_basename, new_basename)
-                                rel.set('Target', new_target)
-                                modified = True
-                
+                    if not target or rel.get('TargetMode') == 'External':
+                        continue
+                    new_name = filename_changes.get(_resolve_part_name(source_part, target))
+                    if new_name is None:
+                        continue
+                    rel.set('Target', self._relative_target(source_part, target, new_name))
+                    modified = True
+
                 if modified:
-                    tree.write(rels_file, encoding='utf-8', xml_declaration=True)
+                    updated_members[info.filename] = ET.tostring(root, encoding='utf-8', xml_declaration=True)
             except Exception as e:
-                print(f"  ⚠️  更新XML引用失败 {rels_file}: {str(e)}")
-    
+                self._emit('message', f"  ⚠️  更新XML引用失败 {info.filename}: {str(e)}", level='warning')
+        return updated_members
+
+    @staticmethod
+    def _relative_target(source_part, target, new_name):
+        """按原Target的写法(绝对/相对路径、是否URL编码)生成指向new_name的Target"""
+        target = target.split('#', 1)[0]
+        target_dir, target_basename = posixpath.split(target)
+        new_basename = posixpath.basename(new_name)
+        if unquote(target_basename) != target_basename:
+            new_basename = quote(new_basename)
+        if posixpath.dirname(_resolve_part_name(source_part, target)) == posixpath.dirname(new_name):
+            # 只是文件名变了，保留原来的目录写法
+            return posixpath.join(target_dir, new_basename)
+        if target.startswith('/'):
+            return '/' + quote(new_name)
+        return quote(posixpath.relpath(new_name, posixpath.dirname(source_part) or '.'))
+
+    def _update_content_types(self, zip_in, filename_changes, updated_members):
+        """
+        改名后的部件在[Content_Types].xml中要有对应的内容类型
+
+        为新的扩展名补充Default条目，删除旧部件名的Override条目。
+
+        Returns:
+            更新后的[Content_Types].xml数据，没有改动时返回None
+        """
+        if '[Content_Types].xml' not in zip_in.NameToInfo:
+            return None
+        original = updated_members.get('[Content_Types].xml') or zip_in.read('[Content_Types].xml')
+        data = original
+        for old_name in filename_changes:
+            data, _ = _remove_element(data, 'Override', 'PartName', '/' + old_name, re.I)
+
+        defaults = re.findall(rb'<Default\s[^>]*?Extension\s*=\s*["\']([^"\']*)["\']', data)
+        known = {ext.decode('utf-8', 'replace').lower() for ext in defaults}
+        entries = b''
+        for new_name in sorted(set(filename_changes.values())):
+            ext = posixpath.splitext(new_name)[1][1:].lower()
+            if ext and ext not in known and ext in self.CONTENT_TYPES:
+                entries += f'<Default Extension="{ext}" ContentType="{self.CONTENT_TYPES[ext]}"/>'.encode('utf-8')
+                known.add(ext)
+        if entries:
+            types_tag = re.search(rb'<Types\b[^>]*>', data)
+            if types_tag is not None:
+                data = data[:types_tag.end()] + entries + data[types_tag.end():]
+        return data if data != original else None
+
     @staticmethod
     def format_size(size_bytes):
         """格式化文件大小"""
@@ -475,6 +2828,135 @@ class ModernPPTCompressor:
         return f"{size_bytes:.2f} TB"
 
 
+def _copy_member_raw(zip_in, info, zip_out):
+    """
+    把输入压缩包中的成员按原始压缩数据直接复制到输出压缩包
+
+    zipfile没有公开的原样复制接口，这里自己读取本地文件头后的压缩数据，
+    再用原成员的CRC和大小写出新的本地文件头。ZIP64成员不处理。
+
+    Returns:
+        是否复制成功，失败时调用方应退回普通的读取+写入
+    """
+    if (info.file_size >= zipfile.ZIP64_LIMIT or info.compress_size >= zipfile.ZIP64_LIMIT
+            or info.filename in zip_out.NameToInfo):
+        return False
+
+    zip_in.fp.seek(info.header_offset)
+    header = zip_in.fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        return False
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    # 跳过本地文件头中的文件名和扩展字段
+    zip_in.fp.seek(fields[10] + fields[11], os.SEEK_CUR)
+    raw_data = zip_in.fp.read(info.compress_size)
+    if len(raw_data) != info.compress_size:
+        return False
+
+    out_info = zipfile.ZipInfo(info.filename, date_time=info.date_time)
+    out_info.compress_type = info.compress_type
+    out_info.external_attr = info.external_attr
+    # 大小和CRC已写入本地文件头，去掉data descriptor标记
+    out_info.flag_bits = info.flag_bits & ~0x08
+    out_info.CRC = info.CRC
+    out_info.compress_size = info.compress_size
+    out_info.file_size = info.file_size
+
+    _write_member_raw(zip_out, out_info, raw_data)
+    return True
+
+
+def _write_member_raw(zip_out, out_info, raw_data):
+    """把已压缩好的数据写入输出压缩包，out_info中需要已填好压缩方式、CRC和大小"""
+    with zip_out._lock:
+        out_info.header_offset = zip_out.fp.tell()
+        zip_out.fp.write(out_info.FileHeader(False))
+        zip_out.fp.write(raw_data)
+        zip_out.filelist.append(out_info)
+        zip_out.NameToInfo[out_info.filename] = out_info
+        zip_out.start_dir = zip_out.fp.tell()
+        zip_out._didModify = True
+
+
+def _deflate_member(data, level):
+    """
+    在线程池中deflate一个成员的数据
+
+    Returns:
+        (原始deflate数据, CRC, 本线程消耗的CPU时间)
+    """
+    cpu_start = time.thread_time()
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    raw_data = compressor.compress(data) + compressor.flush()
+    return raw_data, zlib.crc32(data), time.thread_time() - cpu_start
+
+
+register_backend(EncoderBackend('pillow', ModernPPTCompressor._encode_pillow))
+register_backend(EncoderBackend(
+    'oxipng', ModernPPTCompressor._encode_oxipng,
+    version_command=['oxipng', '--version'], install_hint='brew install oxipng'))
+register_backend(EncoderBackend(
+    'pngquant', ModernPPTCompressor._encode_pngquant,
+    version_command=['pngquant', '--version'], install_hint='brew install pngquant'))
+register_backend(EncoderBackend(
+    'jpegtran', ModernPPTCompressor._encode_jpegtran,
+    version_command=['jpegtran', '-version'], install_hint='brew install mozjpeg'))
+register_backend(EncoderBackend(
+    'cjpeg', ModernPPTCompressor._encode_cjpeg,
+    version_command=['cjpeg', '-version'], install_hint='brew install mozjpeg'))
+
+
+# 进程池中每个子进程持有的压缩器实例
+_worker_compressor = None
+
+
+def _init_worker(compressor, backends):
+    """进程池初始化：每个子进程只接收一次压缩器配置和已注册的编码器"""
+    global _worker_compressor
+    _worker_compressor = compressor
+    ENCODER_BACKENDS.update(backends)
+
+
+def _compress_image_job(image_data, filename, skip_oxipng=False, target_size=None, effort=None,
+                        timeout=None):
+    """
+    在子进程中压缩单张图片，返回压缩结果、使用的编码器、发生的事件、耗时和记录的span(不记录时为None)
+
+    timeout是提交任务时时间预算剩余的秒数，子进程按自己的时钟换算成截止时间
+    """
+    events = []
+    _worker_compressor._deadline = time.monotonic() + timeout if timeout is not None else None
+    _worker_compressor.sinks = [events.append]
+    # 主进程在记录时，子进程每个任务用新的Tracer，只把本张图片的span传回去
+    tracer = Tracer() if _worker_compressor.tracer is not None else None
+    _worker_compressor.tracer = tracer
+    start = time.monotonic()
+    result = _worker_compressor.compress_image(image_data, filename, skip_oxipng=skip_oxipng,
+                                               target_size=target_size, effort=effort)
+    return (result, _worker_compressor._encoder, events, time.monotonic() - start,
+            tracer.spans if tracer else None)
+
+
+def estimate_presets(input_file, presets=None, sample_size=None, seed=0, **options):
+    """
+    预估各档位的压缩结果
+
+    Args:
+        input_file: 输入文件路径
+        presets: 要预估的档位名称列表，默认全部档位
+        sample_size, seed: 见ModernPPTCompressor.estimate
+        options: 传给ModernPPTCompressor的其他参数
+
+    Returns:
+        [ModernPPTCompressor.estimate的结果, ...]，按presets的顺序
+    """
+    results = []
+    for preset in presets or list(ModernPPTCompressor.PRESETS):
+        compressor = ModernPPTCompressor(preset=preset, **options)
+        results.append(compressor.estimate(input_file, sample_size, seed))
+    return results
+
+
 def main():
     """主函数"""
     parser = argparse.ArgumentParser(
@@ -518,6 +3000,9 @@ def main():
 📦 推荐安装oxipng获得最佳PNG压缩效果:
   Mac:   brew install oxipng
   Linux: cargo install oxipng  或  apt install oxipng
+
+  可选编码器（未安装时自动跳过）: pngquant、mozjpeg(cjpeg/jpegtran)
+  lossless档位的JPEG只通过jpegtran无损优化，未安装jpegtran时保持原样
         """
     )
     
@@ -527,12 +3012,91 @@ def main():
                        choices=['lossless', 'high', 'balanced', 'aggressive', 'small', 'mini'],
                        default='balanced',
                        help='压缩档位（默认: balanced）')
+    parser.add_argument('--zip-level', type=int, choices=range(0, 10), default=6,
+                       metavar='0-9',
+                       help='重新打包时XML等文本成员的deflate压缩级别（默认: 6）')
+    parser.add_argument('--merge-duplicates', action='store_true',
+                       help='把内容相同的图片合并为一个成员并改写引用')
+    parser.add_argument('--cache-dir',
+                       help='压缩结果缓存目录，重复压缩相同图片时直接复用（默认不使用缓存）')
+    parser.add_argument('--cache-size', type=int, default=1024, metavar='MB',
+                       help='缓存目录大小上限，单位MB（默认: 1024）')
+    parser.add_argument('--no-oxipng-batch', dest='oxipng_batch', action='store_false',
+                       help='每张PNG单独调用一次oxipng，不批量处理')
+    parser.add_argument('--no-fast-resize', dest='fast_resize', action='store_false',
+                       help='缩小JPEG时完整解码原图，不使用解码器的缩放解码')
+    parser.add_argument('--target-dpi', type=int, default=None,
+                       help='按幻灯片中的显示尺寸限制图片分辨率的目标DPI（默认使用档位设置，0表示不限制）')
+    parser.add_argument('--apply-crops', action='store_true',
+                       help='按图片在幻灯片中的裁剪区域裁掉不可见的部分')
+    parser.add_argument('--keep-orphans', dest='prune_orphans', action='store_false',
+                       help='保留没有被任何关系引用的部件（默认删除）')
+    parser.add_argument('--prune-layouts', action='store_true',
+                       help='删除没有幻灯片使用的版式和母版')
+    parser.add_argument('--ssim', type=float, default=None, metavar='THRESHOLD', dest='ssim_threshold',
+                       help='按SSIM为每张JPEG选择最低的合格质量（例如0.98，需要NumPy）')
+    parser.add_argument('--target-size', type=float, default=None, metavar='MB',
+                       help='目标文件大小（MB），超出时自动降低JPEG质量和分辨率')
+    parser.add_argument('--time-budget', type=float, default=None, metavar='SECONDS',
+                       help='时间预算（秒），按剩余时间降低PNG压缩力度，超时的图片保持原样')
+    parser.add_argument('--memory-limit', type=float, default=None, metavar='MB',
+                       help='图片解码和压缩的内存上限（MB），并行压缩时按估计内存限制同时处理的图片，超过上限的图片保持原样')
+    parser.add_argument('--estimate', action='store_true',
+                       help='不压缩，抽样预估各档位的压缩后大小和耗时')
+    parser.add_argument('--estimate-samples', type=int, default=None, metavar='N',
+                       help=f'预估时抽样压缩的图片数量（默认: {ModernPPTCompressor.ESTIMATE_SAMPLE_SIZE}）')
+    parser.add_argument('--trace', metavar='FILE',
+                       help='记录各阶段和每张图片的耗时，保存为Chrome trace JSON（用chrome://tracing或Perfetto查看）')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                       help='并行压缩图片和重新打包的进程/线程数（默认: CPU核心数，1表示串行）')
     
     args = parser.parse_args()
+    memory_limit = int(args.memory_limit * 1024 * 1024) if args.memory_limit else None
     
     try:
-        compressor = ModernPPTCompressor(preset=args.preset)
-        compressor.compress_ppt(args.input, args.output)
+        if args.estimate:
+            print(f"\n📈 预估各档位的压缩结果: {Path(args.input).name}")
+            results = estimate_presets(args.input, sample_size=args.estimate_samples,
+                                       workers=args.workers, cache_dir=args.cache_dir,
+                                       cache_size=args.cache_size * 1024 * 1024,
+                                       fast_resize=args.fast_resize, target_dpi=args.target_dpi,
+                                       ssim_threshold=args.ssim_threshold, memory_limit=memory_limit)
+            format_size = ModernPPTCompressor.format_size
+            for result in results:
+                reduction = (1 - result['estimated_size'] / result['input_size']) * 100
+                print(f"  {result['preset']:<10} {format_size(result['estimated_size']):>10} "
+                      f"({format_size(result['low'])} - {format_size(result['high'])})  "
+                      f"减小约 {reduction:.0f}%  预计耗时 {result['estimated_seconds']:.1f}s")
+            if results:
+                print(f"抽样 {results[0]['sampled_count']}/{results[0]['image_count']} 个图片，区间为95%置信区间")
+            return
+
+        compressor = ModernPPTCompressor(preset=args.preset, workers=args.workers,
+                                         compresslevel=args.zip_level,
+                                         merge_duplicates=args.merge_duplicates,
+                                         cache_dir=args.cache_dir,
+                                         cache_size=args.cache_size * 1024 * 1024,
+                                         oxipng_batch=args.oxipng_batch,
+                                         fast_resize=args.fast_resize,
+                                         target_dpi=args.target_dpi,
+                                         apply_crops=args.apply_crops,
+                                         prune_orphans=args.prune_orphans,
+                                         prune_layouts=args.prune_layouts,
+                                         time_budget=args.time_budget,
+                                         ssim_threshold=args.ssim_threshold,
+                                         memory_limit=memory_limit,
+                                         target_file_size=(int(args.target_size * 1024 * 1024)
+                                                           if args.target_size else None))
+        tracer = Tracer() if args.trace else None
+        compressor.compress_ppt(args.input, args.output, tracer=tracer)
+        if tracer is not None:
+            tracer.save(args.trace)
+            summary = tracer.summary()
+            print(f"\n🔍 耗时分析已保存: {args.trace}")
+            for category in ('stage', 'encoder'):
+                for name, item in sorted(summary.get(category, {}).items(),
+                                         key=lambda pair: pair[1]['wall'], reverse=True):
+                    print(f"  {name:<18} {item['wall']:7.2f}s  CPU {item['cpu']:7.2f}s  ×{item['count']}")
     except Exception as e:
         print(f"\n❌ 错误: {str(e)}")
         import traceback
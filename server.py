@@ -6,6 +6,7 @@ macOS Sequoia Style - 增强版 Flask 服务器，支持自动打开浏览器
 """
 
 from flask import Flask, render_template, request, send_file, jsonify, Response
+import math
 import os
 import sys
 import webbrowser
@@ -13,7 +14,7 @@ import threading
 import time
 import uuid
 from werkzeug.utils import secure_filename
-from ppt_compressor_v3 import ModernPPTCompressor
+from ppt_compressor_v3 import ModernPPTCompressor, estimate_presets, print_event
 import shutil
 from pathlib import Path
 import queue
@@ -52,6 +53,10 @@ def compress_file():
         file.save(upload_path)
 
         preset = request.form.get('preset', 'balanced')
+        # 时间预算(秒)，为空或不合法时不限制
+        time_budget = request.form.get('time_budget', type=float)
+        if time_budget is not None and (not math.isfinite(time_budget) or time_budget <= 0):
+            time_budget = None
 
         # 生成任务ID
         task_id = str(uuid.uuid4())
@@ -60,7 +65,7 @@ def compress_file():
         # 在后台线程中执行压缩
         thread = threading.Thread(
             target=compress_worker,
-            args=(task_id, upload_path, filename, preset)
+            args=(task_id, upload_path, filename, preset, time_budget)
         )
         thread.daemon = True
         thread.start()
@@ -72,7 +77,7 @@ def compress_file():
 
     return jsonify({'error': '不支持的文件格式'}), 400
 
-def compress_worker(task_id, upload_path, filename, preset):
+def compress_worker(task_id, upload_path, filename, preset, time_budget=None):
     """后台压缩任务"""
     try:
         progress_queue = progress_queues[task_id]
@@ -80,34 +85,32 @@ def compress_worker(task_id, upload_path, filename, preset):
         # 发送初始化消息
         progress_queue.put({'status': 'progress', 'percent': 0, 'message': '开始压缩...'})
 
+        # 进度事件转发给前端，日志仍然输出到控制台
+        def progress_sink(event):
+            if event.kind == 'progress':
+                progress_queue.put({'status': 'progress', 'percent': event.data['percent'],
+                                    'message': event.message})
+
         # 初始化压缩器
-        compressor = ModernPPTCompressor(preset=preset)
+        compressor = ModernPPTCompressor(preset=preset, time_budget=time_budget,
+                                         sinks=[print_event, progress_sink])
 
         # 定义输出路径
         output_filename = f"compressed_{filename}"
         output_path = os.path.join(app.config['COMPRESSED_FOLDER'], output_filename)
 
-        # 定义进度回调函数
-        def progress_callback(percent, message):
-            progress_queue.put({'status': 'progress', 'percent': percent, 'message': message})
-
-        # 压缩（传入进度回调）
-        compressor.compress_ppt(upload_path, output_path, progress_callback=progress_callback)
-
-        # 获取统计信息
-        original_size = os.path.getsize(upload_path)
-        compressed_size = os.path.getsize(output_path)
-        reduction = original_size - compressed_size
-        percent = (reduction / original_size) * 100
+        # 压缩
+        result = compressor.compress_ppt(upload_path, output_path)
 
         # 发送完成消息
         progress_queue.put({
             'status': 'completed',
             'percent': 100,
             'filename': output_filename,
-            'original_size': compressor.format_size(original_size),
-            'compressed_size': compressor.format_size(compressed_size),
-            'reduction': f"{percent:.1f}%",
+            'original_size': compressor.format_size(result.input_size),
+            'compressed_size': compressor.format_size(result.output_size),
+            'reduction': f"{result.reduction * 100:.1f}%",
+            'image_count': result.compressed_count,
             'download_url': f"/download/{output_filename}"
         })
 
@@ -125,6 +128,45 @@ def compress_worker(task_id, upload_path, filename, preset):
             except:
                 pass
 
+@app.route('/estimate', methods=['POST'])
+def estimate_file():
+    """抽样预估各档位的压缩结果，不生成压缩文件"""
+    if 'file' not in request.files:
+        return jsonify({'error': '没有上传文件'}), 400
+
+    file = request.files['file']
+    if not (file.filename.endswith('.ppt') or file.filename.endswith('.pptx')):
+        return jsonify({'error': '不支持的文件格式'}), 400
+
+    presets = request.form.getlist('preset') or None
+    if presets and any(preset not in ModernPPTCompressor.PRESETS for preset in presets):
+        return jsonify({'error': '未知的压缩档位'}), 400
+
+    filename = secure_filename(file.filename)
+    upload_path = os.path.join(app.config['UPLOAD_FOLDER'], f"estimate_{uuid.uuid4().hex}_{filename}")
+    file.save(upload_path)
+    try:
+        results = estimate_presets(upload_path, presets=presets)
+    except Exception as e:
+        print(f"预估错误: {str(e)}")
+        return jsonify({'error': f'预估失败: {str(e)}'}), 500
+    finally:
+        if os.path.exists(upload_path):
+            try:
+                os.remove(upload_path)
+            except:
+                pass
+
+    format_size = ModernPPTCompressor.format_size
+    estimates = []
+    for result in results:
+        reduction = (1 - result['estimated_size'] / result['input_size']) * 100
+        estimates.append(dict(result,
+                              estimated_size_text=format_size(result['estimated_size']),
+                              range_text=f"{format_size(result['low'])} - {format_size(result['high'])}",
+                              reduction=f"{reduction:.1f}%"))
+    return jsonify({'success': True, 'estimates': estimates})
+
 @app.route('/progress/<task_id>')
 def progress(task_id):
     """SSE 进度流"""
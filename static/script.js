@@ -87,6 +87,7 @@ document.addEventListener('DOMContentLoaded', function() {
         if (!selectedFile) return;
 
         const preset = document.querySelector('input[name="preset"]:checked').value;
+        const timeBudget = document.getElementById('timeBudget').value;
 
         // Update button state
         compressBtn.disabled = true;
@@ -101,6 +102,9 @@ document.addEventListener('DOMContentLoaded', function() {
             const formData = new FormData();
             formData.append('file', selectedFile);
             formData.append('preset', preset);
+            if (timeBudget) {
+                formData.append('time_budget', timeBudget);
+            }
 
             // Send request to start compression
             const response = await fetch('/compress', {